@@ -7,137 +7,174 @@ from datetime import datetime
 
 
 class P2PChatbot:
+    # (raw, normalized) for the last message seen by _normalize
+    _last_normalized = (None, "")
+    
     def __init__(self, workflow):
         self.workflow = workflow
         
+    def _normalize(self, user_message: str) -> str:
+        """
+        Lowercased, stripped message
+        Memoized for the last message so every layer handling the same turn shares one pass
+        """
+        cached = self._last_normalized
+        if cached[0] is not user_message:
+            cached = (user_message, user_message.lower().strip())
+            self._last_normalized = cached
+        return cached[1]
+    
     def process_message(self, user_message: str) -> dict:
         """
         Process user message and return appropriate response
         Returns dict with 'message' and optional 'data' for structured display
         """
-        message = user_message.lower().strip()
+        message = self._normalize(user_message)
         
+        handler = self._route(message)
+        if handler is not None:
+            return handler()
+        
+        # Default response
+        return {
+            'message': "I'm not sure I understand. Try asking:\n\n" +
+                      "• 'Show statistics'\n" +
+                      "• 'What's pending approval?'\n" +
+                      "• 'Explain the P2P process'\n" +
+                      "• 'Find PO [number]'\n" +
+                      "• 'Show blocked documents'\n\n" +
+                      "Type 'help' for more options!"
+        }
+    
+    def _rule_based_can_answer(self, user_message: str) -> bool:
+        """Check if the rule-based system has a handler for the message (without formatting a response)"""
+        return self._route(self._normalize(user_message)) is not None
+    
+    def _route(self, message: str):
+        """
+        Pick the handler for a normalized (lowercased, stripped) message
+        Returns a zero-argument callable producing the response, or None if no rule matches
+        """
         # Approval policies query - check FIRST
         if ('approval polic' in message or 'approval rule' in message):
-            return self._explain_approval_process()
+            return self._explain_approval_process
         
         # Which/what queries - handle FIRST before anything else
         if ('which' in message or 'what' in message):
             # Check for blocked queries
             if 'blocked' in message:
                 if 'invoice' in message:
-                    return self._get_blocked_invoices_only()
+                    return self._get_blocked_invoices_only
                 elif 'po' in message or 'purchase order' in message:
-                    return self._get_blocked_pos_only()
+                    return self._get_blocked_pos_only
                 elif 'gr' in message or 'goods receipt' in message:
-                    return self._get_blocked_grs_only()
+                    return self._get_blocked_grs_only
                 else:
-                    return self._get_blocked_documents()
+                    return self._get_blocked_documents
             # Check for pending queries (but not if asking ABOUT policies)
             elif ('pending' in message or 'approval' in message) and 'polic' not in message:
                 if 'invoice' in message:
-                    return self._get_pending_invoices_only()
+                    return self._get_pending_invoices_only
                 elif 'po' in message or 'purchase order' in message:
-                    return self._get_pending_pos_only()
+                    return self._get_pending_pos_only
             # Check for overdue
             elif 'overdue' in message:
-                return self._get_overdue_info()
+                return self._get_overdue_info
         
         # Greeting patterns - only match if it's JUST a greeting
         if message in ['hello', 'hi', 'hey', 'greetings', 'hello!', 'hi!', 'hey!']:
-            return {
-                'message': "Hello! I'm your P2P Workflow Assistant. I can help you with:\n\n" +
-                          "• View statistics and summaries\n" +
-                          "• Check pending approvals\n" +
-                          "• Find purchase orders, goods receipts, or invoices\n" +
-                          "• Explain the P2P process\n" +
-                          "• Check blocked documents\n\n" +
-                          "Just ask me anything about the procurement process!"
-            }
+            return self._greeting
         
         # Help patterns
         if self._matches(message, ['help', 'what can you do', 'commands']):
-            return {
-                'message': "I can help you with:\n\n" +
-                          "📊 **Statistics**: 'show stats', 'how many POs', 'total spend'\n" +
-                          "⏳ **Pending**: 'pending approvals', 'what needs approval'\n" +
-                          "🚫 **Blocked**: 'blocked documents', 'show blocked items'\n" +
-                          "📋 **Search**: 'find PO [number]', 'show invoice [number]'\n" +
-                          "❓ **Process**: 'explain P2P', 'how does approval work'\n" +
-                          "💰 **Financial**: 'total spend', 'paid invoices', 'overdue'\n\n" +
-                          "Try asking in natural language!"
-            }
+            return self._help
         
         # Statistics queries
         if self._matches(message, ['stats', 'statistics', 'summary', 'overview']):
-            return self._get_statistics()
+            return self._get_statistics
         
         if self._matches(message, ['how many', 'count']) and 'po' in message:
-            return self._count_documents('purchase orders')
+            return lambda: self._count_documents('purchase orders')
         
         if self._matches(message, ['how many', 'count']) and ('gr' in message or 'goods receipt' in message):
-            return self._count_documents('goods receipts')
+            return lambda: self._count_documents('goods receipts')
         
         if self._matches(message, ['how many', 'count']) and 'invoice' in message:
-            return self._count_documents('invoices')
+            return lambda: self._count_documents('invoices')
         
         if self._matches(message, ['total spend', 'how much spent', 'spending']):
-            return self._get_spend_info()
+            return self._get_spend_info
         
         # Pending approvals (only if not already handled by which/what)
         if self._matches(message, ['pending', 'waiting', 'needs approval', 'awaiting']) and 'which' not in message and 'what' not in message:
-            return self._get_pending_approvals()
+            return self._get_pending_approvals
         
         # Blocked documents - enhanced queries
         if self._matches(message, ['blocked', 'stuck', 'issues', 'problems']):
             # Check if asking about specific document type
             if 'invoice' in message:
-                return self._get_blocked_invoices_only()
+                return self._get_blocked_invoices_only
             elif 'po' in message or 'purchase order' in message:
-                return self._get_blocked_pos_only()
+                return self._get_blocked_pos_only
             elif 'gr' in message or 'goods receipt' in message:
-                return self._get_blocked_grs_only()
+                return self._get_blocked_grs_only
             else:
-                return self._get_blocked_documents()
+                return self._get_blocked_documents
         
         # Process explanations
         if self._matches(message, ['explain', 'what is', 'how does']) and 'p2p' in message:
-            return self._explain_p2p_process()
+            return self._explain_p2p_process
         
         if self._matches(message, ['approval', 'approval process', 'how approval']):
-            return self._explain_approval_process()
+            return self._explain_approval_process
         
         if self._matches(message, ['three-way', '3-way', 'matching']):
-            return self._explain_three_way_matching()
+            return self._explain_three_way_matching
         
         # "Why" questions about specific documents
         if self._matches(message, ['why', 'reason']):
-            return self._handle_why_question(message)
+            return lambda: self._handle_why_question(message)
         
         # Document search
         if self._matches(message, ['find', 'show', 'get', 'search', 'look up']):
-            return self._search_documents(message)
+            return lambda: self._search_documents(message)
         
         # Financial queries
         if self._matches(message, ['paid', 'payments']):
-            return self._get_payment_info()
+            return self._get_payment_info
         
         if self._matches(message, ['overdue', 'late', 'past due']):
-            return self._get_overdue_info()
+            return self._get_overdue_info
         
         # Vendor queries
         if self._matches(message, ['vendor', 'supplier']) and ('list' in message or 'show' in message):
-            return self._list_vendors()
+            return self._list_vendors
         
-        # Default response
+        return None
+    
+    def _greeting(self) -> dict:
+        """Greeting response"""
         return {
-            'message': "I'm not sure I understand. Try asking:\n\n" +
-                      "• 'Show statistics'\n" +
-                      "• 'What's pending approval?'\n" +
-                      "• 'Explain the P2P process'\n" +
-                      "• 'Find PO [number]'\n" +
-                      "• 'Show blocked documents'\n\n" +
-                      "Type 'help' for more options!"
+            'message': "Hello! I'm your P2P Workflow Assistant. I can help you with:\n\n" +
+                      "• View statistics and summaries\n" +
+                      "• Check pending approvals\n" +
+                      "• Find purchase orders, goods receipts, or invoices\n" +
+                      "• Explain the P2P process\n" +
+                      "• Check blocked documents\n\n" +
+                      "Just ask me anything about the procurement process!"
+        }
+    
+    def _help(self) -> dict:
+        """Help response"""
+        return {
+            'message': "I can help you with:\n\n" +
+                      "📊 **Statistics**: 'show stats', 'how many POs', 'total spend'\n" +
+                      "⏳ **Pending**: 'pending approvals', 'what needs approval'\n" +
+                      "🚫 **Blocked**: 'blocked documents', 'show blocked items'\n" +
+                      "📋 **Search**: 'find PO [number]', 'show invoice [number]'\n" +
+                      "❓ **Process**: 'explain P2P', 'how does approval work'\n" +
+                      "💰 **Financial**: 'total spend', 'paid invoices', 'overdue'\n\n" +
+                      "Try asking in natural language!"
         }
     
     def _matches(self, message: str, patterns: list) -> bool:
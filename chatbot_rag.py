@@ -5,9 +5,17 @@ No training needed - just provide knowledge and let LLM reason!
 """
 from typing import Dict, Optional
 from datetime import datetime
+import threading
+import weakref
 from chatbot import P2PChatbot
 
 
+# Resources shared by every RAG chatbot in the process
+_KB_CACHE = weakref.WeakKeyDictionary()  # workflow -> (workflow version, knowledge base)
+_QA_PIPELINE = None  # Flan-T5 pipeline, loaded on first use
+_SHARED_LOCK = threading.Lock()
+
+
 class P2PChatbotRAG(P2PChatbot):
     """
     RAG (Retrieval-Augmented Generation) chatbot
@@ -19,8 +27,8 @@ class P2PChatbotRAG(P2PChatbot):
         self.llm_backend = llm_backend
         self.llm = None
         
-        # Build knowledge base from workflow
-        self.knowledge_base = self._build_knowledge_base()
+        # Build knowledge base from workflow (shared with other instances)
+        self.knowledge_base = self._get_knowledge_base()
         
         if llm_backend == "transformers":
             self._init_transformers()
@@ -32,6 +40,15 @@ class P2PChatbotRAG(P2PChatbot):
             print("✓ Using rule-based with RAG knowledge base")
             print("  100% FREE - Answers questions about YOUR P2P system")
     
+    def _get_knowledge_base(self) -> str:
+        """Knowledge base for this workflow, reused across instances until the workflow changes"""
+        with _SHARED_LOCK:
+            cached = _KB_CACHE.get(self.workflow)
+            if cached is None or cached[0] != self.workflow.version:
+                cached = (self.workflow.version, self._build_knowledge_base())
+                _KB_CACHE[self.workflow] = cached
+            return cached[1]
+    
     def _build_knowledge_base(self) -> str:
         """
         Build knowledge base from actual workflow data
@@ -83,15 +100,19 @@ class P2PChatbotRAG(P2PChatbot):
     
     def _init_transformers(self):
         """Initialize Transformers with better Q&A model"""
+        global _QA_PIPELINE
         try:
-            from transformers import pipeline
-            print("  Loading Flan-T5 model (best free Q&A model)...")
-            self.llm = pipeline(
-                "text2text-generation",
-                model="google/flan-t5-base",  # Better than small, still free
-                max_length=512,
-                device=-1
-            )
+            with _SHARED_LOCK:
+                if _QA_PIPELINE is None:
+                    from transformers import pipeline
+                    print("  Loading Flan-T5 model (best free Q&A model)...")
+                    _QA_PIPELINE = pipeline(
+                        "text2text-generation",
+                        model="google/flan-t5-base",  # Better than small, still free
+                        max_length=512,
+                        device=-1
+                    )
+            self.llm = _QA_PIPELINE
             print("✓ Transformers RAG enabled (100% free)")
             print("  Model: google/flan-t5-base (trained for Q&A)")
             print("  Knowledge base loaded from YOUR workflow")
@@ -7,10 +7,48 @@ The chatbot can use tools/functions to perform tasks like:
 - Call external APIs
 """
 from typing import Dict, List, Optional, Callable
+import heapq
 import json
+import os
 import numpy as np
 from datetime import datetime
 from chatbot import P2PChatbot
+from stats_kernels import compute_stats, z_scores
+
+
+# Currency formatter shared by the result formatters
+_fmt_usd = "${:,.2f}".format
+
+# Color/icon lookups used by the result formatters
+_SEVERITY_COLOR = {'HIGH': '#dc3545', 'MEDIUM': '#ffc107', 'LOW': '#28a745'}
+_RISK_ICONS = {'CRITICAL': '🔴', 'HIGH': '🟠', 'MEDIUM': '🟡', 'LOW': '🟢'}
+
+
+# Opening section of the blocked-document explanation (filled per call)
+_BLOCKED_HEADER_TMPL = """
+<div style="background: white; padding: 20px; border-radius: 8px; border: 2px solid #dc3545;">
+    <h5 style="color: #dc3545;">
+        <i class="fas fa-ban"></i> Blocked Document Analysis
+    </h5>
+    
+    <div style="background: #f8f9fa; padding: 15px; border-radius: 5px; margin: 15px 0;">
+        <div style="margin-bottom: 10px;"><strong>Document Type:</strong> {doc_type}</div>
+        <div style="margin-bottom: 10px;"><strong>Document ID:</strong> <code>{document_id}</code></div>
+        <div style="margin-bottom: 10px;"><strong>Status:</strong> <span style="color: #dc3545; font-weight: bold;">{status}</span></div>
+        <div style="margin-bottom: 10px;"><strong>Amount:</strong> {amount}</div>
+        <div><strong>Vendor:</strong> {vendor}</div>
+    </div>
+    
+    <div style="background: #fff3cd; padding: 15px; border-radius: 5px; border-left: 4px solid #ffc107; margin: 15px 0;">
+        <strong>🔍 KG Reasoning Insight:</strong>
+        <p style="margin: 10px 0 0 0;">{insight}</p>
+    </div>
+    
+    <h6 style="margin-top: 20px; color: #dc3545;">
+        <i class="fas fa-exclamation-triangle"></i> Blocking Reasons:
+    </h6>
+    <div style="margin: 10px 0;">
+""".format
 
 
 class P2PChatbotWithTools(P2PChatbot):
@@ -19,6 +57,9 @@ class P2PChatbotWithTools(P2PChatbot):
     Can use external functions to perform analysis and tasks
     """
     
+    # openai module, imported on first use and shared by all instances
+    _openai = None
+    
     def __init__(self, workflow, llm_backend: str = "none"):
         super().__init__(workflow)
         self.llm_backend = llm_backend
@@ -163,31 +204,29 @@ class P2PChatbotWithTools(P2PChatbot):
         else:
             return {"error": "Invalid document type"}
         
-        # Get amounts
-        amounts = [doc.total_amount for doc in documents]
-        
-        if len(amounts) < 3:
+        if len(documents) < 3:
             return {"error": "Not enough data for outlier analysis"}
         
+        # Get amounts
+        amounts = np.fromiter((doc.total_amount for doc in documents), dtype=np.float64, count=len(documents))
+        
         # Calculate statistics
         mean = np.mean(amounts)
         std_dev = np.std(amounts)
         
-        # Find outliers
+        # Find outliers (only the flagged documents are touched in Python)
+        z = z_scores(amounts, mean, std_dev)
         outliers = []
-        for doc in documents:
-            z_score = abs(doc.total_amount - mean) / std_dev if std_dev > 0 else 0
-            
-            if z_score > threshold:
-                outlier_info = {
-                    "id": doc.id,
-                    "number": getattr(doc, 'po_number', None) or getattr(doc, 'invoice_number', None) or getattr(doc, 'gr_number', None),
-                    "amount": doc.total_amount,
-                    "z_score": round(z_score, 2),
-                    "deviation_from_mean": round(doc.total_amount - mean, 2),
-                    "vendor": getattr(doc, 'vendor_name', 'N/A')
-                }
-                outliers.append(outlier_info)
+        for i in np.flatnonzero(z > threshold):
+            doc = documents[i]
+            outliers.append({
+                "id": doc.id,
+                "number": getattr(doc, 'po_number', None) or getattr(doc, 'invoice_number', None) or getattr(doc, 'gr_number', None),
+                "amount": doc.total_amount,
+                "z_score": round(float(z[i]), 2),
+                "deviation_from_mean": round(doc.total_amount - mean, 2),
+                "vendor": getattr(doc, 'vendor_name', 'N/A')
+            })
         
         # Sort by z-score descending
         outliers.sort(key=lambda x: x['z_score'], reverse=True)
@@ -213,24 +252,26 @@ class P2PChatbotWithTools(P2PChatbot):
         else:
             return {"error": "Invalid document type"}
         
-        amounts = [doc.total_amount for doc in documents]
-        
-        if not amounts:
+        if not documents:
             return {"error": "No documents found"}
         
+        amounts = np.fromiter((doc.total_amount for doc in documents), dtype=np.float64, count=len(documents))
+        (count, total, mean, median, std_dev, min_amount, max_amount,
+         p25, p50, p75, p95) = compute_stats(amounts)
+        
         return {
             "document_type": document_type,
-            "count": len(amounts),
-            "mean": round(np.mean(amounts), 2),
-            "median": round(np.median(amounts), 2),
-            "std_dev": round(np.std(amounts), 2),
-            "min": round(min(amounts), 2),
-            "max": round(max(amounts), 2),
-            "percentile_25": round(np.percentile(amounts, 25), 2),
-            "percentile_50": round(np.percentile(amounts, 50), 2),
-            "percentile_75": round(np.percentile(amounts, 75), 2),
-            "percentile_95": round(np.percentile(amounts, 95), 2),
-            "total": round(sum(amounts), 2)
+            "count": int(count),
+            "mean": round(mean, 2),
+            "median": round(median, 2),
+            "std_dev": round(std_dev, 2),
+            "min": round(min_amount, 2),
+            "max": round(max_amount, 2),
+            "percentile_25": round(p25, 2),
+            "percentile_50": round(p50, 2),
+            "percentile_75": round(p75, 2),
+            "percentile_95": round(p95, 2),
+            "total": round(total, 2)
         }
     
     def _tool_find_spending_trends(self, group_by: str) -> Dict:
@@ -258,7 +299,7 @@ class P2PChatbotWithTools(P2PChatbot):
         elif group_by == "month":
             trends = {}
             for po in pos:
-                month = po.creation_date.strftime("%Y-%m")
+                month = po.month_key
                 if month not in trends:
                     trends[month] = {"count": 0, "total": 0}
                 trends[month]["count"] += 1
@@ -267,17 +308,13 @@ class P2PChatbotWithTools(P2PChatbot):
         else:
             return {"error": "Invalid group_by parameter"}
         
-        # Sort by total descending
-        sorted_trends = sorted(
-            [{"category": k, **v} for k, v in trends.items()],
-            key=lambda x: x["total"],
-            reverse=True
-        )
+        # Top 10 by total, descending
+        top = heapq.nlargest(10, trends.items(), key=lambda kv: kv[1]["total"])
         
         return {
             "group_by": group_by,
-            "categories": len(sorted_trends),
-            "trends": sorted_trends[:10]  # Top 10
+            "categories": len(trends),
+            "trends": [{"category": k, **v} for k, v in top]
         }
     
     def _tool_predict_payment_date(self, invoice_id: str) -> Dict:
@@ -477,7 +514,7 @@ class P2PChatbotWithTools(P2PChatbot):
             if doc.total_amount > 50000:
                 reasons.append({
                     "category": "High Value Transaction",
-                    "description": f"Amount ${doc.total_amount:,.2f} exceeds standard threshold",
+                    "description": f"Amount {_fmt_usd(doc.total_amount)} exceeds standard threshold",
                     "severity": "MEDIUM"
                 })
                 recommendations.append("Obtain executive approval for high-value transaction")
@@ -634,10 +671,10 @@ class P2PChatbotWithTools(P2PChatbot):
             <strong>Outliers Found:</strong> <span style="color: #dc3545;">{result['outliers_found']}</span>
         </div>
         <div style="background: #e7f3ff; padding: 10px; border-radius: 5px;">
-            <strong>Mean Amount:</strong> ${result['mean_amount']:,.2f}
+            <strong>Mean Amount:</strong> {_fmt_usd(result['mean_amount'])}
         </div>
         <div style="background: #e7f3ff; padding: 10px; border-radius: 5px;">
-            <strong>Std Deviation:</strong> ${result['std_dev']:,.2f}
+            <strong>Std Deviation:</strong> {_fmt_usd(result['std_dev'])}
         </div>
     </div>
     
@@ -720,7 +757,7 @@ class P2PChatbotWithTools(P2PChatbot):
                 html += f"""
                 <tr>
                     <td style="padding: 8px; border-bottom: 1px solid #dee2e6;"><strong>{outlier['number']}</strong></td>
-                    <td style="padding: 8px; text-align: right; border-bottom: 1px solid #dee2e6;">${outlier['amount']:,.2f}</td>
+                    <td style="padding: 8px; text-align: right; border-bottom: 1px solid #dee2e6;">{_fmt_usd(outlier['amount'])}</td>
                     <td style="padding: 8px; text-align: right; border-bottom: 1px solid #dee2e6;"><span style="color: #dc3545;">{outlier['z_score']}σ</span></td>
                     <td style="padding: 8px; border-bottom: 1px solid #dee2e6;">{outlier['vendor']}</td>
                 </tr>
@@ -739,70 +776,71 @@ class P2PChatbotWithTools(P2PChatbot):
         if "error" in result:
             return f"❌ {result['error']}"
         
-        response = f"📊 **Statistical Analysis: {result['document_type'].replace('_', ' ').title()}**\n\n"
-        response += f"**Distribution:**\n"
-        response += f"• Count: {result['count']} documents\n"
-        response += f"• Total: ${result['total']:,.2f}\n"
-        response += f"• Mean: ${result['mean']:,.2f}\n"
-        response += f"• Median: ${result['median']:,.2f}\n"
-        response += f"• Std Dev: ${result['std_dev']:,.2f}\n\n"
-        
-        response += f"**Range:**\n"
-        response += f"• Min: ${result['min']:,.2f}\n"
-        response += f"• Max: ${result['max']:,.2f}\n\n"
-        
-        response += f"**Percentiles:**\n"
-        response += f"• 25th: ${result['percentile_25']:,.2f}\n"
-        response += f"• 50th: ${result['percentile_50']:,.2f}\n"
-        response += f"• 75th: ${result['percentile_75']:,.2f}\n"
-        response += f"• 95th: ${result['percentile_95']:,.2f}\n"
-        
-        return response
+        parts = [
+            f"📊 **Statistical Analysis: {result['document_type'].replace('_', ' ').title()}**\n\n",
+            "**Distribution:**\n",
+            f"• Count: {result['count']} documents\n",
+            f"• Total: {_fmt_usd(result['total'])}\n",
+            f"• Mean: {_fmt_usd(result['mean'])}\n",
+            f"• Median: {_fmt_usd(result['median'])}\n",
+            f"• Std Dev: {_fmt_usd(result['std_dev'])}\n\n",
+            
+            "**Range:**\n",
+            f"• Min: {_fmt_usd(result['min'])}\n",
+            f"• Max: {_fmt_usd(result['max'])}\n\n",
+            
+            "**Percentiles:**\n",
+            f"• 25th: {_fmt_usd(result['percentile_25'])}\n",
+            f"• 50th: {_fmt_usd(result['percentile_50'])}\n",
+            f"• 75th: {_fmt_usd(result['percentile_75'])}\n",
+            f"• 95th: {_fmt_usd(result['percentile_95'])}\n",
+        ]
+        
+        return "".join(parts)
     
     def _format_trends_result(self, result: Dict) -> str:
         """Format trends result"""
         if "error" in result:
             return f"❌ {result['error']}"
         
-        response = f"📈 **Spending Trends by {result['group_by'].title()}**\n\n"
-        response += f"**Top {len(result['trends'])} Categories:**\n\n"
+        parts = [
+            f"📈 **Spending Trends by {result['group_by'].title()}**\n\n",
+            f"**Top {len(result['trends'])} Categories:**\n\n"
+        ]
         
         for i, trend in enumerate(result['trends'], 1):
-            response += f"{i}. **{trend['category']}**\n"
-            response += f"   💰 Total: ${trend['total']:,.2f}\n"
-            response += f"   📋 Count: {trend['count']} documents\n"
-            response += f"   💵 Average: ${trend['total']/trend['count']:,.2f}\n\n"
-        
-        return response
+            avg = trend['total'] / trend['count']
+            parts.append(
+                f"{i}. **{trend['category']}**\n"
+                f"   💰 Total: {_fmt_usd(trend['total'])}\n"
+                f"   📋 Count: {trend['count']} documents\n"
+                f"   💵 Average: {_fmt_usd(avg)}\n\n"
+            )
+        
+        return "".join(parts)
     
     def _format_risk_result(self, result: Dict) -> str:
         """Format risk assessment result"""
         if "error" in result:
             return f"❌ {result['error']}"
         
-        risk_icons = {
-            "CRITICAL": "🔴",
-            "HIGH": "🟠",
-            "MEDIUM": "🟡",
-            "LOW": "🟢"
-        }
-        
-        icon = risk_icons.get(result['risk_level'], "⚪")
+        icon = _RISK_ICONS.get(result['risk_level'], "⚪")
         
-        response = f"{icon} **Risk Assessment: {result['document_type']}**\n\n"
-        response += f"**Document ID:** {result['document_id']}\n"
-        response += f"**Risk Level:** {result['risk_level']}\n"
-        response += f"**Risk Score:** {result['risk_score']}/10\n\n"
+        parts = [
+            f"{icon} **Risk Assessment: {result['document_type']}**\n\n",
+            f"**Document ID:** {result['document_id']}\n",
+            f"**Risk Level:** {result['risk_level']}\n",
+            f"**Risk Score:** {result['risk_score']}/10\n\n"
+        ]
         
         if result['risk_factors']:
-            response += f"**Risk Factors:**\n"
-            for factor in result['risk_factors']:
-                response += f"• {factor}\n"
-            response += "\n"
+            parts.append("**Risk Factors:**\n")
+            parts.extend(f"• {factor}\n" for factor in result['risk_factors'])
+            parts.append("\n")
         
-        response += f"**Recommendation:**\n{result['recommendation']}"
+        parts.append(f"**Recommendation:**\n{result['recommendation']}")
         
-        return response
+        return "".join(parts)
     
     def _format_blocked_explanation(self, result: Dict) -> str:
         """Format blocked document explanation using KG reasoning"""
@@ -814,37 +852,17 @@ class P2PChatbotWithTools(P2PChatbot):
             return f"ℹ️ {result.get('message', 'Document is not blocked')}"
         
         # Build comprehensive explanation
-        html = f"""
-<div style="background: white; padding: 20px; border-radius: 8px; border: 2px solid #dc3545;">
-    <h5 style="color: #dc3545;">
-        <i class="fas fa-ban"></i> Blocked Document Analysis
-    </h5>
-    
-    <div style="background: #f8f9fa; padding: 15px; border-radius: 5px; margin: 15px 0;">
-        <div style="margin-bottom: 10px;"><strong>Document Type:</strong> {result['doc_type']}</div>
-        <div style="margin-bottom: 10px;"><strong>Document ID:</strong> <code>{result['document_id']}</code></div>
-        <div style="margin-bottom: 10px;"><strong>Status:</strong> <span style="color: #dc3545; font-weight: bold;">{result['status']}</span></div>
-        <div style="margin-bottom: 10px;"><strong>Amount:</strong> ${result['amount']:,.2f}</div>
-        <div><strong>Vendor:</strong> {result['vendor']}</div>
-    </div>
-    
-    <div style="background: #fff3cd; padding: 15px; border-radius: 5px; border-left: 4px solid #ffc107; margin: 15px 0;">
-        <strong>🔍 KG Reasoning Insight:</strong>
-        <p style="margin: 10px 0 0 0;">{result['insight']}</p>
-    </div>
-    
-    <h6 style="margin-top: 20px; color: #dc3545;">
-        <i class="fas fa-exclamation-triangle"></i> Blocking Reasons:
-    </h6>
-    <div style="margin: 10px 0;">
-"""
+        html = _BLOCKED_HEADER_TMPL(
+            doc_type=result['doc_type'],
+            document_id=result['document_id'],
+            status=result['status'],
+            amount=_fmt_usd(result['amount']),
+            vendor=result['vendor'],
+            insight=result['insight']
+        )
         
         for i, reason in enumerate(result.get('reasons', []), 1):
-            severity_color = {
-                'HIGH': '#dc3545',
-                'MEDIUM': '#ffc107',
-                'LOW': '#28a745'
-            }.get(reason.get('severity', 'MEDIUM'), '#6c757d')
+            severity_color = _SEVERITY_COLOR.get(reason.get('severity', 'MEDIUM'), '#6c757d')
             
             html += f"""
         <div style="background: #f8f9fa; padding: 12px; border-radius: 5px; margin-bottom: 10px; border-left: 4px solid {severity_color};">
@@ -895,8 +913,10 @@ class P2PChatbotWithTools(P2PChatbot):
     def _init_openai(self):
         """Initialize OpenAI with function calling"""
         try:
-            import openai
-            import os
+            if P2PChatbotWithTools._openai is None:
+                import openai
+                P2PChatbotWithTools._openai = openai
+            openai = P2PChatbotWithTools._openai
             api_key = os.getenv('OPENAI_API_KEY')
             if api_key:
                 openai.api_key = api_key
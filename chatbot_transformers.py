@@ -5,18 +5,53 @@ Runs smaller models locally in pure Python
 """
 from typing import Dict, Optional
 from datetime import datetime
+import os
+import re
 from chatbot import P2PChatbot
 
 
+# transformers/torch, imported on first use and kept for later instances
+_pipeline = None
+_torch = None
+
+# Static parts of the generation prompt
+_PROMPT_PREFIX = "P2P Workflow Assistant\n\nSystem State:\n"
+_PROMPT_SPLIT = "Assistant:"
+
+# Keywords that route a message to the rule-based system (data queries),
+# unless the user is asking for an explanation
+_DATA_QUERY_RE = re.compile(r'which|blocked|pending|stats|find|show', re.I)
+_EXPLAIN_RE = re.compile(r'what is|explain|tell me', re.I)
+
+
 class P2PChatbotTransformers(P2PChatbot):
     """
     Enhanced chatbot with Hugging Face Transformers
     Uses free, local models - 100% free, pure Python
     """
     
+    # Model actually loaded for generation (model_name is only reported)
+    _GENERATION_MODEL = "distilgpt2"  # Small, fast, free
+    
+    # Loaded pipelines shared by all instances, keyed by the loaded model
+    _PIPELINE_CACHE: dict = {}
+    
+    # Fixed sampling settings passed to every generator call
+    _GEN_KWARGS = {
+        'max_new_tokens': 100,
+        'num_return_sequences': 1,
+        'num_beams': 1,
+        'temperature': 0.7,
+        'do_sample': True,
+        'pad_token_id': 50256,
+    }
+    
     def __init__(self, workflow, model_name: str = "microsoft/DialoGPT-medium"):
         super().__init__(workflow)
         self.model_name = model_name
+        # Context summary, rebuilt only when the workflow version changes
+        self._context_cache = None
+        self._context_version = None
         self.use_llm = self._initialize_transformers()
         
         if self.use_llm:
@@ -29,19 +64,33 @@ class P2PChatbotTransformers(P2PChatbot):
     
     def _initialize_transformers(self) -> bool:
         """Initialize Hugging Face Transformers"""
+        global _pipeline, _torch
         try:
-            from transformers import pipeline
-            print("  Loading model (first time may take a minute)...")
+            if _pipeline is None:
+                from transformers import pipeline as _pipeline
+                import torch as _torch
             
-            # Use a small, fast model for chatbot
-            self.generator = pipeline(
-                "text-generation",
-                model="distilgpt2",  # Small, fast, free
-                max_length=200,
-                device=-1  # CPU (use 0 for GPU if available)
-            )
+            model = P2PChatbotTransformers._GENERATION_MODEL
+            gen = P2PChatbotTransformers._PIPELINE_CACHE.get(model)
+            if gen is None:
+                print("  Loading model (first time may take a minute)...")
+                
+                # Inference only: no autograd, and avoid CPU thread oversubscription
+                _torch.set_num_threads(max(1, (os.cpu_count() or 2) // 2))
+                _torch.set_grad_enabled(False)
+                
+                # Use a small, fast model for chatbot
+                gen = _pipeline(
+                    "text-generation",
+                    model=model,
+                    device=-1  # CPU (use 0 for GPU if available)
+                )
+                P2PChatbotTransformers._PIPELINE_CACHE[model] = gen
+                
+                print("  Model loaded successfully!")
             
-            print("  Model loaded successfully!")
+            self.generator = gen
+            self._torch = _torch
             return True
             
         except ImportError:
@@ -55,21 +104,16 @@ class P2PChatbotTransformers(P2PChatbot):
         """
         Process user message with Transformers or fall back to rule-based system
         """
-        message_lower = user_message.lower()
-        
         # For specific data queries, use rule-based (more accurate for real-time data)
         # Only use rule-based if asking about specific documents/data
-        if any(keyword in message_lower for keyword in ['which', 'blocked', 'pending', 'stats', 'find', 'show']) and not any(keyword in message_lower for keyword in ['what is', 'explain', 'tell me']):
+        if _DATA_QUERY_RE.search(user_message) and not _EXPLAIN_RE.search(user_message):
             return super().process_message(user_message)
         
         # For general questions and explanations, try LLM first
         if self.use_llm:
-            # Check if it's a question the rule-based system can handle well
-            rule_response = super().process_message(user_message)
-            
-            # If rule-based gives a real answer (not the default "I'm not sure"), use it
-            if "I'm not sure" not in rule_response['message']:
-                return rule_response
+            # If the rule-based system has a handler for it, use that
+            if self._rule_based_can_answer(user_message):
+                return super().process_message(user_message)
             
             # Otherwise try Transformers
             return self._process_with_transformers(user_message)
@@ -82,26 +126,14 @@ class P2PChatbotTransformers(P2PChatbot):
         try:
             context = self._build_context()
             
-            prompt = f"""P2P Workflow Assistant
-
-System State:
-{context}
-
-User: {user_message}
-Assistant:"""
+            prompt = f"{_PROMPT_PREFIX}{context}\n\nUser: {user_message}\n{_PROMPT_SPLIT}"
             
-            response = self.generator(
-                prompt,
-                max_length=len(prompt.split()) + 100,
-                num_return_sequences=1,
-                temperature=0.7,
-                do_sample=True,
-                pad_token_id=50256
-            )
+            with self._torch.inference_mode():
+                response = self.generator(prompt, **self._GEN_KWARGS)
             
             # Extract just the assistant's response
             full_text = response[0]['generated_text']
-            assistant_response = full_text.split("Assistant:")[-1].strip()
+            assistant_response = full_text.rpartition(_PROMPT_SPLIT)[2].strip()
             
             return {'message': assistant_response}
                 
@@ -110,13 +142,18 @@ Assistant:"""
             return super().process_message(user_message)
     
     def _build_context(self) -> str:
-        """Build context summary"""
+        """Build context summary (cached until the workflow changes)"""
+        if self._context_version == self.workflow.version:
+            return self._context_cache
+        
         stats = self.workflow.get_statistics()
         
         context = f"""POs: {stats['total_pos']} (Approved: {stats['approved_pos']}, Pending: {stats['pending_pos']}, Blocked: {stats['blocked_pos']})
 Invoices: {stats['total_invoices']} (Paid: {stats['paid_invoices']}, Overdue: {stats['overdue_invoices']})
 Total Spend: ${stats['total_spend']:,.2f}"""
         
+        self._context_cache = context
+        self._context_version = self.workflow.version
         return context
 
 
@@ -2,10 +2,415 @@
 Ultimate P2P Chatbot: RAG + Optional Tools
 Best of all worlds: Knowledge base + Optional advanced analysis
 """
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+import json
+import logging
+import re
+import uuid
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from operator import attrgetter
 import numpy as np
 from datetime import datetime
 from chatbot_rag import P2PChatbotRAG
+from chatbot_tools import P2PChatbotWithTools
+from models import BlockedCategory
+from stats_kernels import compute_stats, zscore_outliers
+
+logger = logging.getLogger(__name__)
+
+# Max number of memoized tool results kept per chatbot (LRU)
+_TOOL_CACHE_SIZE = 128
+
+
+# Routing keywords, tagged in a single scan of the lowercased message.
+# Each alternative sits in a lookahead so overlapping keywords are all found;
+# matching is by substring, except the standalone "po"/"gr" abbreviations.
+_KEYWORD_RE = re.compile(
+    r'(?=(?P<blocked>blocked)'
+    r'|(?P<why>why|explain|what)'
+    r'|(?P<outlier>outlier)'
+    r'|(?P<stats>detailed stat|full stat|complete stat)'
+    r'|(?P<trend>trend|spending pattern|spending history|spend by)'
+    r'|(?P<department>department)'
+    r'|(?P<vendor>vendor)'
+    r'|(?P<month>month|time|history)'
+    r'|(?P<risk>risk|assess)'
+    r'|(?P<invoice>invoice)'
+    r'|(?P<purchase_order>purchase order)'
+    r'|(?P<goods_receipt>goods receipt)'
+    r'|(?P<po_word>(?:^|(?<= ))po(?= |$))'
+    r'|(?P<po>po)'
+    r'|(?P<gr_word>(?:^|(?<= ))gr(?= |$)))'
+)
+
+
+def _keyword_tags(message: str) -> set:
+    """Set of routing keyword tags present in a lowercased message"""
+    return {m.lastgroup for m in _KEYWORD_RE.finditer(message)}
+
+
+# Words that may name a document: anything with a hyphen or an INV/PO/GR prefix
+_DOC_TOKEN_RE = re.compile(r'-|INV|PO|GR')
+
+# Grouping key for each supported spending-trend dimension
+_TREND_KEYS = {
+    "department": attrgetter("department"),
+    "vendor": attrgetter("vendor_name"),
+    "month": attrgetter("month_key"),
+}
+
+
+# Shared styles for repeated rows, emitted once per response instead of inline on every cell
+_TREND_TABLE_STYLE = (
+    "<style>"
+    ".p2p-trends{width:100%;font-size:0.9em;border-collapse:collapse}"
+    ".p2p-trends thead{background:#f8f9fa}"
+    ".p2p-trends th{padding:8px;text-align:left;border-bottom:2px solid #dee2e6}"
+    ".p2p-trends td{padding:8px;border-bottom:1px solid #dee2e6}"
+    ".p2p-trends tbody tr:nth-child(even){background:#f8f9fa}"
+    ".p2p-trends .p2p-r{text-align:right}"
+    ".p2p-trends .p2p-c{text-align:center}"
+    ".p2p-trends .p2p-total{color:#1976d2;font-weight:bold}"
+    "</style>"
+)
+_OUTLIER_ROW_STYLE = (
+    "<style>"
+    ".p2p-outlier{display:flex;justify-content:space-between;align-items:center;padding:8px 0;border-bottom:1px solid #ffe082}"
+    ".p2p-outlier-doc{flex:1}"
+    ".p2p-outlier-doc strong{color:#f57c00}"
+    ".p2p-outlier-doc span{font-size:12px;color:#666}"
+    ".p2p-outlier-amt{text-align:right}"
+    ".p2p-outlier-amt div:first-child{font-size:18px;font-weight:bold;color:#d32f2f}"
+    ".p2p-outlier-amt div:last-child{font-size:11px;color:#f57c00}"
+    "</style>"
+)
+
+
+# Outlier summary + box plot HTML for _format_outlier_result
+def _outlier_html(*, doc_type_display, total_documents, outliers_found, mean, std_dev,
+                  min_val, max_val, q1, median, q3,
+                  q1_pct, box_width_pct, median_box_pct, median_pct, q3_pct, upper_pct) -> str:
+    """Outlier summary cards and box plot, specialized for one fixed layout"""
+    return f"""
+<div style="background: white; padding: 20px; border-radius: 8px; border: 1px solid #dee2e6; max-width: 800px;">
+    <h5 style="margin-top: 0;">📊 Outlier Analysis: {doc_type_display}</h5>
+    
+    <!-- Summary Cards -->
+    <div style="display: grid; grid-template-columns: repeat(4, 1fr); gap: 10px; margin: 20px 0;">
+        <div style="background: #e3f2fd; padding: 12px; border-radius: 6px; text-align: center;">
+            <div style="font-size: 24px; font-weight: bold; color: #1976d2;">{total_documents}</div>
+            <div style="font-size: 11px; color: #666;">Total Documents</div>
+        </div>
+        <div style="background: #ffebee; padding: 12px; border-radius: 6px; text-align: center;">
+            <div style="font-size: 24px; font-weight: bold; color: #d32f2f;">{outliers_found}</div>
+            <div style="font-size: 11px; color: #666;">Outliers Found</div>
+        </div>
+        <div style="background: #e8f5e9; padding: 12px; border-radius: 6px; text-align: center;">
+            <div style="font-size: 18px; font-weight: bold; color: #388e3c;">${mean:,.0f}</div>
+            <div style="font-size: 11px; color: #666;">Mean Amount</div>
+        </div>
+        <div style="background: #fff3e0; padding: 12px; border-radius: 6px; text-align: center;">
+            <div style="font-size: 18px; font-weight: bold; color: #f57c00;">${std_dev:,.0f}</div>
+            <div style="font-size: 11px; color: #666;">Std Deviation</div>
+        </div>
+    </div>
+    
+    <!-- Box Plot Visualization -->
+    <div style="margin: 30px 0;">
+        <h6 style="margin-bottom: 15px;">📦 Distribution Box Plot</h6>
+        <div style="position: relative; height: 120px; background: #f8f9fa; border-radius: 4px; padding: 20px;">
+            <!-- Scale line -->
+            <div style="position: absolute; top: 60px; left: 20px; right: 20px; height: 2px; background: #dee2e6;"></div>
+            
+            <!-- Min marker -->
+            <div style="position: absolute; top: 50px; left: 20px;">
+                <div style="width: 2px; height: 20px; background: #666; margin: 0 auto;"></div>
+                <div style="font-size: 10px; margin-top: 5px; white-space: nowrap;">${min_val:,.0f}</div>
+            </div>
+            
+            <!-- Box (Q1 to Q3) -->
+            <div style="position: absolute; top: 45px; left: calc(20px + {q1_pct}%); width: {box_width_pct}%; height: 30px; background: #90caf9; border: 2px solid #1976d2; border-radius: 4px;">
+                <!-- Median line -->
+                <div style="position: absolute; left: {median_box_pct}%; top: 0; bottom: 0; width: 3px; background: #d32f2f;"></div>
+            </div>
+            
+            <!-- Q1 label -->
+            <div style="position: absolute; top: 80px; left: calc(20px + {q1_pct}%); font-size: 10px; transform: translateX(-50%);">
+                Q1<br>${q1:,.0f}
+            </div>
+            
+            <!-- Median label -->
+            <div style="position: absolute; top: 25px; left: calc(20px + {median_pct}%); font-size: 10px; transform: translateX(-50%); color: #d32f2f; font-weight: bold;">
+                Median<br>${median:,.0f}
+            </div>
+            
+            <!-- Q3 label -->
+            <div style="position: absolute; top: 80px; left: calc(20px + {q3_pct}%); font-size: 10px; transform: translateX(-50%);">
+                Q3<br>${q3:,.0f}
+            </div>
+            
+            <!-- Max marker -->
+            <div style="position: absolute; top: 50px; right: 20px;">
+                <div style="width: 2px; height: 20px; background: #666; margin: 0 auto;"></div>
+                <div style="font-size: 10px; margin-top: 5px; white-space: nowrap;">${max_val:,.0f}</div>
+            </div>
+            
+            <!-- Outlier threshold lines -->
+            <div style="position: absolute; top: 35px; left: calc(20px + {upper_pct}%); width: 2px; height: 50px; background: #ff5722; border-left: 2px dashed #ff5722;"></div>
+            <div style="position: absolute; top: 20px; left: calc(20px + {upper_pct}%); font-size: 9px; color: #ff5722; white-space: nowrap; transform: translateX(-50%);">
+                +2σ
+            </div>
+        </div>
+        <div style="margin-top: 10px; font-size: 11px; color: #666;">
+            <span style="color: #1976d2;">█</span> Normal Range (Q1-Q3) &nbsp;
+            <span style="color: #d32f2f;">│</span> Median &nbsp;
+            <span style="color: #ff5722;">┊</span> Outlier Threshold (±2σ)
+        </div>
+    </div>
+"""
+
+
+# Static pieces of the blocked-invoice analysis card.
+# Each "Action Required" block is assembled once here, per blocked-reason kind
+_ACTION_OPEN_HTML = """
+        <div style="background: #e3f2fd; padding: 15px; border-radius: 6px; border-left: 4px solid #1976d2; margin-top: 15px;">
+            <h6 style="margin-top: 0; color: #1976d2;">✅ Action Required</h6>
+            <ul style="margin: 0; padding-left: 20px; color: #1565c0;">
+"""
+_ACTION_CLOSE_HTML = """
+            </ul>
+        </div>
+"""
+_ACTION_PRICE_HTML = _ACTION_OPEN_HTML + """
+                <li style="margin: 8px 0;">Validate invoice line items against Purchase Order</li>
+                <li style="margin: 8px 0;">Contact vendor for corrected invoice or approve variance</li>
+                <li style="margin: 8px 0;"><strong>Contact:</strong> Accounts Payable and vendor</li>
+""" + _ACTION_CLOSE_HTML
+_ACTION_3WAY_HTML = _ACTION_OPEN_HTML + """
+                <li style="margin: 8px 0;">Verify all documents match (PO, GR, Invoice)</li>
+                <li style="margin: 8px 0;">Reconcile discrepancies between documents</li>
+                <li style="margin: 8px 0;"><strong>Contact:</strong> Procurement, Warehouse, and AP teams</li>
+""" + _ACTION_CLOSE_HTML
+_ACTION_DEFAULT_HTML = _ACTION_OPEN_HTML + """
+                <li style="margin: 8px 0;">Investigate and resolve blocking issue</li>
+                <li style="margin: 8px 0;">Review invoice details and unblock</li>
+                <li style="margin: 8px 0;"><strong>Contact:</strong> Accounts Payable manager</li>
+""" + _ACTION_CLOSE_HTML
+_ACTION_HTML = {
+    BlockedCategory.PRICE: _ACTION_PRICE_HTML,
+    BlockedCategory.THREE_WAY: _ACTION_3WAY_HTML,
+    BlockedCategory.MATCHING: _ACTION_DEFAULT_HTML,
+    BlockedCategory.OTHER: _ACTION_DEFAULT_HTML,
+}
+_INVOICE_CARD_CLOSE_HTML = """
+    </div>
+</div>
+"""
+
+# Price-variance severity of a blocked invoice, from LOW (<= 5%) to HIGH (> 10%):
+# (color, label, background, explanation)
+_SEVERITY_TABLE = (
+    ("#fbc02d", "LOW", "#fffde7", "Minor variance detected"),
+    ("#f57c00", "MEDIUM", "#fff3e0", "Variance exceeds 5% tolerance - review needed"),
+    ("#d32f2f", "HIGH", "#ffebee", "Variance exceeds 10% tolerance - immediate attention required"),
+)
+# Upper bounds (inclusive) of the LOW and MEDIUM rows, for bisect_left
+_SEVERITY_THRESHOLDS = (5.0, 10.0)
+
+# Risk level -> (gauge color, icon, recommendation background, recommendation border)
+_RISK_TABLE = {
+    "CRITICAL": ("#d32f2f", "🔴", "#ffebee", "#d32f2f"),
+    "HIGH": ("#f57c00", "🟠", "#fff3e0", "#f57c00"),
+    "MEDIUM": ("#fbc02d", "🟡", "#fffde7", "#fbc02d"),
+    "LOW": ("#388e3c", "🟢", "#e8f5e9", "#388e3c"),
+}
+_RISK_DEFAULT = ("#9e9e9e", "⚪", "#f5f5f5", "#9e9e9e")
+
+# Recommendation returned by _tool_risk_assessment for each risk level
+_RISK_RECOMMENDATIONS = {
+    "CRITICAL": "Immediate action required - escalate to management",
+    "HIGH": "Priority attention needed - review within 24 hours",
+    "MEDIUM": "Monitor closely - review within this week",
+    "LOW": "Normal processing - standard workflow"
+}
+
+
+# Sections of the blocked-invoice analysis card for _format_blocked_invoice_analysis
+def _invoice_header_html(inv) -> str:
+    """Card opening: document info, blocked reason and the root-cause heading"""
+    return f"""
+<div style="background: white; padding: 20px; border-radius: 8px; border: 1px solid #dee2e6; max-width: 800px;">
+    <h5 style="margin-top: 0;">🚫 Why is {inv.invoice_number} Blocked?</h5>
+    
+    <!-- Document Info Card -->
+    <div style="background: #ffebee; padding: 15px; border-radius: 6px; margin: 15px 0; border-left: 4px solid #d32f2f;">
+        <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 15px;">
+            <div>
+                <div style="font-size: 11px; color: #666; text-transform: uppercase;">Invoice Number</div>
+                <div style="font-size: 18px; font-weight: bold; color: #d32f2f;">{inv.invoice_number}</div>
+            </div>
+            <div>
+                <div style="font-size: 11px; color: #666; text-transform: uppercase;">Vendor</div>
+                <div style="font-size: 16px; font-weight: bold; color: #333;">{inv.vendor_name}</div>
+            </div>
+            <div>
+                <div style="font-size: 11px; color: #666; text-transform: uppercase;">Amount</div>
+                <div style="font-size: 18px; font-weight: bold; color: #d32f2f;">${inv.total_amount:,.2f}</div>
+            </div>
+            <div>
+                <div style="font-size: 11px; color: #666; text-transform: uppercase;">Status</div>
+                <div style="font-size: 16px; font-weight: bold; color: #d32f2f;">{inv.status.value}</div>
+            </div>
+        </div>
+    </div>
+    
+    <!-- Blocked Reason -->
+    <div style="background: #fff3cd; padding: 15px; border-radius: 6px; margin: 15px 0; border-left: 4px solid #ffc107;">
+        <h6 style="margin-top: 0; color: #856404;">🚫 Blocked Reason</h6>
+        <p style="margin: 0; font-size: 14px; color: #856404;"><strong>{inv.blocked_reason}</strong></p>
+    </div>
+    
+    <!-- Root Cause Analysis -->
+    <div style="margin: 20px 0;">
+        <h6>📊 Root Cause Analysis</h6>
+"""
+
+
+def _price_discrepancy_html(po_total: float, inv_total: float) -> str:
+    """PO vs invoice amounts with the variance severity"""
+    diff = abs(po_total - inv_total)
+    variance = (diff / po_total * 100) if po_total > 0 else 0
+    
+    severity_color, severity_label, severity_bg, severity_text = _SEVERITY_TABLE[
+        bisect_left(_SEVERITY_THRESHOLDS, variance)
+    ]
+    
+    return f"""
+        <div style="background: #f8f9fa; padding: 15px; border-radius: 6px; margin-bottom: 15px;">
+            <strong style="color: #d32f2f;">💰 Price Discrepancy Detected</strong>
+            <div style="margin-top: 10px; display: grid; grid-template-columns: repeat(3, 1fr); gap: 10px;">
+                <div style="background: white; padding: 10px; border-radius: 4px; text-align: center;">
+                    <div style="font-size: 11px; color: #666;">PO Amount</div>
+                    <div style="font-size: 18px; font-weight: bold; color: #1976d2;">${po_total:,.2f}</div>
+                </div>
+                <div style="background: white; padding: 10px; border-radius: 4px; text-align: center;">
+                    <div style="font-size: 11px; color: #666;">Invoice Amount</div>
+                    <div style="font-size: 18px; font-weight: bold; color: #d32f2f;">${inv_total:,.2f}</div>
+                </div>
+                <div style="background: white; padding: 10px; border-radius: 4px; text-align: center;">
+                    <div style="font-size: 11px; color: #666;">Variance</div>
+                    <div style="font-size: 18px; font-weight: bold; color: {severity_color};">{variance:.1f}%</div>
+                </div>
+            </div>
+            <div style="margin-top: 10px; padding: 10px; background: {severity_bg}; border-radius: 4px;">
+                <strong style="color: {severity_color};">Severity: {severity_label}</strong>
+                <div style="font-size: 13px; color: #666; margin-top: 5px;">
+                    {severity_text}
+                </div>
+            </div>
+        </div>
+"""
+
+
+def _three_way_html(inv) -> str:
+    """The three documents involved in a failed three-way match"""
+    return f"""
+        <div style="background: #f8f9fa; padding: 15px; border-radius: 6px; margin-bottom: 15px;">
+            <strong style="color: #d32f2f;">🔗 Three-Way Matching Failure</strong>
+            <div style="margin-top: 15px;">
+                <div style="margin: 10px 0; padding: 10px; background: white; border-radius: 4px; border-left: 3px solid #1976d2;">
+                    <strong>1. Purchase Order:</strong> {inv.po_number}
+                </div>
+                <div style="margin: 10px 0; padding: 10px; background: white; border-radius: 4px; border-left: 3px solid #388e3c;">
+                    <strong>2. Goods Receipt:</strong> {inv.gr_number}
+                </div>
+                <div style="margin: 10px 0; padding: 10px; background: white; border-radius: 4px; border-left: 3px solid #d32f2f;">
+                    <strong>3. Invoice:</strong> {inv.invoice_number}
+                </div>
+            </div>
+        </div>
+"""
+
+
+def _urgency_html(days_until_due: int) -> str:
+    """Overdue / due-soon banner ("" when the due date is a week or more away)"""
+    if days_until_due < 0:
+        return f"""
+        <div style="background: #d32f2f; color: white; padding: 15px; border-radius: 6px; margin-top: 15px; text-align: center;">
+            <strong style="font-size: 16px;">⚠️ URGENT: Invoice is {abs(days_until_due)} days overdue!</strong>
+            <div style="font-size: 13px; margin-top: 5px;">Immediate action required to avoid penalties</div>
+        </div>
+"""
+    if days_until_due < 7:
+        return f"""
+        <div style="background: #f57c00; color: white; padding: 15px; border-radius: 6px; margin-top: 15px; text-align: center;">
+            <strong style="font-size: 16px;">⚡ Priority: Invoice due in {days_until_due} days</strong>
+            <div style="font-size: 13px; margin-top: 5px;">Please expedite resolution</div>
+        </div>
+"""
+    return ""
+
+
+# Blocked PO / GR analysis card for _format_blocked_po_analysis / _format_blocked_gr_analysis
+def _blocked_doc_html(*, number, number_label, related, related_label, amount, reason, action) -> str:
+    """Blocked-document card, specialized for one fixed layout"""
+    return f"""
+<div style="background: white; padding: 20px; border-radius: 8px; border: 1px solid #dee2e6; max-width: 800px;">
+    <h5 style="margin-top: 0;">🚫 Why is {number} Blocked?</h5>
+    
+    <div style="background: #ffebee; padding: 15px; border-radius: 6px; margin: 15px 0; border-left: 4px solid #d32f2f;">
+        <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 15px;">
+            <div>
+                <div style="font-size: 11px; color: #666;">{number_label}</div>
+                <div style="font-size: 18px; font-weight: bold; color: #d32f2f;">{number}</div>
+            </div>
+            <div>
+                <div style="font-size: 11px; color: #666;">{related_label}</div>
+                <div style="font-size: 16px; font-weight: bold;">{related}</div>
+            </div>
+            <div>
+                <div style="font-size: 11px; color: #666;">Amount</div>
+                <div style="font-size: 18px; font-weight: bold; color: #d32f2f;">${amount:,.2f}</div>
+            </div>
+            <div>
+                <div style="font-size: 11px; color: #666;">Blocked Reason</div>
+                <div style="font-size: 14px; font-weight: bold; color: #856404;">{reason}</div>
+            </div>
+        </div>
+    </div>
+    
+    <div style="background: #e3f2fd; padding: 15px; border-radius: 6px; margin-top: 15px;">
+        <h6 style="margin-top: 0;">✅ Action Required</h6>
+        <p style="margin: 0;">{action}</p>
+    </div>
+</div>
+"""
+
+
+# Static pieces of the risk assessment card
+_RISK_GAUGE_LABELS_HTML = """
+            <!-- Risk labels -->
+            <div style="position: absolute; bottom: 5px; left: 20px; right: 20px; display: flex; justify-content: space-between; font-size: 10px; color: #666;">
+                <span>🟢 LOW</span>
+                <span>🟡 MEDIUM</span>
+                <span>🟠 HIGH</span>
+                <span>🔴 CRITICAL</span>
+            </div>
+        </div>
+        """
+_RISK_FACTORS_OPEN_HTML = """
+    <div style="margin: 25px 0;">
+        <h6>⚠️ Risk Factors</h6>
+        <div style="background: #fff3cd; border-left: 4px solid #ffc107; padding: 15px; border-radius: 4px;">
+            <ul style="margin: 0; padding-left: 20px;">
+"""
+_RISK_FACTORS_CLOSE_HTML = """
+            </ul>
+        </div>
+    </div>
+"""
 
 
 class P2PChatbotUltimate(P2PChatbotRAG):
@@ -16,6 +421,13 @@ class P2PChatbotUltimate(P2PChatbotRAG):
     3. Optional advanced analytical tools
     """
     
+    # Workflow store, document-number attribute and display label per document type
+    _DOC_TYPES = {
+        "purchase_orders": ("purchase_orders", "po_number", "Purchase Order"),
+        "invoices": ("invoices", "invoice_number", "Invoice"),
+        "goods_receipts": ("goods_receipts", "gr_number", "Goods Receipt"),
+    }
+    
     def __init__(self, workflow, llm_backend: str = "transformers", tools_enabled: bool = False):
         super().__init__(workflow, llm_backend=llm_backend)
         
@@ -23,6 +435,27 @@ class P2PChatbotUltimate(P2PChatbotRAG):
         self.tools_enabled = tools_enabled
         self.enabled_tools = []
         
+        # Current time while a message is being processed (None otherwise)
+        self._now = None
+        
+        # Results of data-only tools, keyed on (tool, args, workflow version)
+        self._tool_cache: "OrderedDict[tuple, Dict]" = OrderedDict()
+        
+        # Per-document-type (ids, amounts) arrays, rebuilt when the workflow version changes
+        self._amount_cache: Dict[str, Tuple[List[str], np.ndarray]] = {}
+        self._amount_cache_version = None
+        
+        # Document number/id lookup for _handle_why_question (see _get_doc_index)
+        self._doc_index = None
+        self._doc_index_version = None
+        
+        # Tool chatbot used to explain blocked documents (see _get_tool_bot)
+        self._tool_bot = None
+        
+        # Blocked documents listed by _handle_why_question (see _blocked_snapshot)
+        self._blocked_cache = None
+        self._blocked_cache_version = None
+        
         # Register tools
         self._register_tools()
         
@@ -50,82 +483,90 @@ class P2PChatbotUltimate(P2PChatbotRAG):
         """
         Process message: Try tools first (if enabled), check for blocked doc questions, then RAG/rule-based
         """
-        message = user_message.lower().strip()
-        
-        # Check for blocked document explanation requests FIRST (before tools)
-        if 'blocked' in message and ('why' in message or 'explain' in message or 'what' in message):
-            # This is asking about blocked documents - use KG reasoning
-            kg_response = self._handle_why_question(user_message)
-            if kg_response and 'message' in kg_response:
-                # Check if KG reasoning provided a good answer
-                if not any(x in kg_response['message'] for x in ['not found', 'no blocked', 'not blocked']):
-                    return kg_response
-        
-        # If tools are enabled, check if message requires a tool
-        if self.tools_enabled:
-            tool_response = self._try_tools(message)
-            if tool_response:
-                return tool_response
-        
-        # Fall back to RAG/rule-based processing
-        return super().process_message(user_message)
+        # One clock read per message, shared by every tool this turn
+        self._now = datetime.now()
+        try:
+            message = self._normalize(user_message)
+            tags = _keyword_tags(message)
+            
+            # Check for blocked document explanation requests FIRST (before tools)
+            if 'blocked' in tags and 'why' in tags:
+                # This is asking about blocked documents - use KG reasoning
+                kg_response = self._handle_why_question(user_message)
+                if kg_response and 'message' in kg_response:
+                    # Check if KG reasoning provided a good answer
+                    if not any(x in kg_response['message'] for x in ['not found', 'no blocked', 'not blocked']):
+                        return kg_response
+            
+            # If tools are enabled, check if message requires a tool
+            if self.tools_enabled:
+                tool_response = self._try_tools(message, tags)
+                if tool_response:
+                    return tool_response
+            
+            # Fall back to RAG/rule-based processing
+            return super().process_message(user_message)
+        finally:
+            self._now = None
     
-    def _try_tools(self, message: str) -> Optional[dict]:
+    def _try_tools(self, message: str, tags: Optional[set] = None) -> Optional[dict]:
         """Try to handle message with tools"""
+        if tags is None:
+            tags = _keyword_tags(message)
         
         # Outlier analysis
         if 'analyze_outliers' in self.enabled_tools:
-            if any(kw in message for kw in ['outlier', 'outliers', 'find outlier']):
+            if 'outlier' in tags:
                 # Determine document type
-                if 'invoice' in message:
-                    result = self._tool_analyze_outliers("invoices")
+                if 'invoice' in tags:
+                    result = self._cached_tool('analyze_outliers', "invoices")
                     return {'message': self._format_outlier_result(result)}
-                elif 'purchase order' in message or ' po ' in message or message.endswith(' po') or message.startswith('po '):
-                    result = self._tool_analyze_outliers("purchase_orders")
+                elif 'purchase_order' in tags or 'po_word' in tags:
+                    result = self._cached_tool('analyze_outliers', "purchase_orders")
                     return {'message': self._format_outlier_result(result)}
-                elif 'goods receipt' in message or ' gr ' in message or message.endswith(' gr') or message.startswith('gr '):
-                    result = self._tool_analyze_outliers("goods_receipts")
+                elif 'goods_receipt' in tags or 'gr_word' in tags:
+                    result = self._cached_tool('analyze_outliers', "goods_receipts")
                     return {'message': self._format_outlier_result(result)}
                 else:
                     # Default to invoices
-                    result = self._tool_analyze_outliers("invoices")
+                    result = self._cached_tool('analyze_outliers', "invoices")
                     return {'message': self._format_outlier_result(result)}
         
         # Statistics calculation
         if 'calculate_statistics' in self.enabled_tools:
-            if any(kw in message for kw in ['detailed stat', 'full stat', 'complete stat']):
-                if 'po' in message or 'purchase order' in message:
-                    result = self._tool_calculate_statistics("purchase_orders")
+            if 'stats' in tags:
+                if 'po' in tags or 'po_word' in tags or 'purchase_order' in tags:
+                    result = self._cached_tool('calculate_statistics', "purchase_orders")
                     return {'message': self._format_statistics_result(result)}
-                elif 'invoice' in message:
-                    result = self._tool_calculate_statistics("invoices")
+                elif 'invoice' in tags:
+                    result = self._cached_tool('calculate_statistics', "invoices")
                     return {'message': self._format_statistics_result(result)}
         
         # Spending trends
         if 'find_spending_trends' in self.enabled_tools:
-            if any(kw in message for kw in ['trend', 'spending pattern', 'spending history', 'spend by']):
-                print(f"[DEBUG] Spending trend request detected. Message: '{message}'")
-                if 'department' in message:
-                    print(f"[DEBUG] → Analyzing by DEPARTMENT")
-                    result = self._tool_find_spending_trends("department")
+            if 'trend' in tags:
+                logger.debug("Spending trend request detected. Message: %r", message)
+                if 'department' in tags:
+                    logger.debug("Analyzing trends by DEPARTMENT")
+                    result = self._cached_tool('find_spending_trends', "department")
                     return {'message': self._format_trends_result(result)}
-                elif 'vendor' in message:
-                    print(f"[DEBUG] → Analyzing by VENDOR")
-                    result = self._tool_find_spending_trends("vendor")
+                elif 'vendor' in tags:
+                    logger.debug("Analyzing trends by VENDOR")
+                    result = self._cached_tool('find_spending_trends', "vendor")
                     return {'message': self._format_trends_result(result)}
-                elif 'month' in message or 'time' in message or 'history' in message:
-                    print(f"[DEBUG] → Analyzing by MONTH")
-                    result = self._tool_find_spending_trends("month")
+                elif 'month' in tags:
+                    logger.debug("Analyzing trends by MONTH")
+                    result = self._cached_tool('find_spending_trends', "month")
                     return {'message': self._format_trends_result(result)}
                 else:
                     # Default to month for general trend questions
-                    print(f"[DEBUG] → Defaulting to MONTH analysis")
-                    result = self._tool_find_spending_trends("month")
+                    logger.debug("Defaulting to MONTH trend analysis")
+                    result = self._cached_tool('find_spending_trends', "month")
                     return {'message': self._format_trends_result(result)}
         
         # Risk assessment
         if 'risk_assessment' in self.enabled_tools:
-            if 'risk' in message or 'assess' in message:
+            if 'risk' in tags:
                 words = message.split()
                 for word in words:
                     if '-' in word:
@@ -134,20 +575,49 @@ class P2PChatbotUltimate(P2PChatbotRAG):
         
         return None
     
+    def _cached_tool(self, name: str, *args) -> Dict:
+        """Run a data-only tool, reusing its last result while the workflow is unchanged"""
+        key = (name, args, self.workflow.version)
+        result = self._tool_cache.get(key)
+        if result is not None:
+            self._tool_cache.move_to_end(key)
+            return result
+        
+        result = self.tool_functions[name](*args)
+        self._tool_cache[key] = result
+        if len(self._tool_cache) > _TOOL_CACHE_SIZE:
+            self._tool_cache.popitem(last=False)
+        return result
+    
     # ==================== TOOL IMPLEMENTATIONS ====================
     
+    def _get_ids_and_amounts(self, document_type: str) -> Tuple[List[str], np.ndarray]:
+        """Ids and total amounts of all documents of a type, as parallel arrays (cached)"""
+        if self._amount_cache_version != self.workflow.version:
+            self._amount_cache.clear()
+            self._amount_cache_version = self.workflow.version
+        
+        cached = self._amount_cache.get(document_type)
+        if cached is None:
+            docs = getattr(self.workflow, self._DOC_TYPES[document_type][0])
+            ids = list(docs)
+            amounts = np.fromiter((docs[doc_id].total_amount for doc_id in ids), dtype=np.float64, count=len(ids))
+            cached = self._amount_cache[document_type] = (ids, amounts)
+        return cached
+    
+    def _get_amounts(self, document_type: str) -> np.ndarray:
+        """Total amounts of all documents of a type (cached)"""
+        return self._get_ids_and_amounts(document_type)[1]
+    
     def _tool_analyze_outliers(self, document_type: str, threshold: float = 2.0) -> Dict:
         """Identify outliers using Z-score"""
-        if document_type == "purchase_orders":
-            documents = list(self.workflow.purchase_orders.values())
-        elif document_type == "invoices":
-            documents = list(self.workflow.invoices.values())
-        elif document_type == "goods_receipts":
-            documents = list(self.workflow.goods_receipts.values())
-        else:
+        doc_info = self._DOC_TYPES.get(document_type)
+        if doc_info is None:
             return {"error": "Invalid document type"}
+        store_name, number_attr, _ = doc_info
+        store = getattr(self.workflow, store_name)
         
-        amounts = [doc.total_amount for doc in documents]
+        doc_ids, amounts = self._get_ids_and_amounts(document_type)
         
         if len(amounts) < 3:
             return {"error": "Not enough data for outlier analysis"}
@@ -155,104 +625,106 @@ class P2PChatbotUltimate(P2PChatbotRAG):
         mean = np.mean(amounts)
         std_dev = np.std(amounts)
         
+        # Box-plot summary for the formatter (np.percentile partitions, no full sort)
+        q1, median, q3 = np.percentile(amounts, [25, 50, 75])
+        
+        # Flag outliers in one pass; only the top 10 are turned into dicts
+        idx, z_flagged = zscore_outliers(amounts, mean, std_dev, float(threshold))
+        z_rounded = np.round(z_flagged, 2)
+        order = np.argsort(-z_rounded, kind='stable')[:10]
+        top = idx[order]
+        
+        # Pick the number/vendor accessors once for this document type
+        get_number = attrgetter(number_attr)
+        if hasattr(next(iter(store.values())), 'vendor_name'):
+            get_vendor = attrgetter('vendor_name')
+        else:
+            get_vendor = lambda doc: 'N/A'
+        
         outliers = []
-        for doc in documents:
-            z_score = abs(doc.total_amount - mean) / std_dev if std_dev > 0 else 0
-            
-            if z_score > threshold:
-                # Get correct document number based on type
-                if document_type == "purchase_orders":
-                    doc_number = doc.po_number
-                elif document_type == "invoices":
-                    doc_number = doc.invoice_number
-                elif document_type == "goods_receipts":
-                    doc_number = doc.gr_number
-                else:
-                    doc_number = "Unknown"
-                
-                outlier_info = {
-                    "id": doc.id,
-                    "number": doc_number,
-                    "amount": doc.total_amount,
-                    "z_score": round(z_score, 2),
-                    "deviation_from_mean": round(doc.total_amount - mean, 2),
-                    "vendor": getattr(doc, 'vendor_name', 'N/A')
-                }
-                outliers.append(outlier_info)
-        
-        outliers.sort(key=lambda x: x['z_score'], reverse=True)
+        for i, z_score in zip(top, z_rounded[order]):
+            doc = store[doc_ids[i]]
+            outliers.append({
+                "id": doc.id,
+                "number": get_number(doc),
+                "amount": doc.total_amount,
+                "z_score": float(z_score),
+                "deviation_from_mean": round(doc.total_amount - mean, 2),
+                "vendor": get_vendor(doc)
+            })
         
         return {
             "document_type": document_type,
-            "total_documents": len(documents),
+            "total_documents": len(store),
             "mean_amount": round(mean, 2),
             "std_dev": round(std_dev, 2),
             "threshold": threshold,
-            "outliers_found": len(outliers),
-            "outliers": outliers[:10]
+            "outliers_found": len(idx),
+            "outliers": outliers,
+            "q1": q1,
+            "median": median,
+            "q3": q3,
+            "min": amounts.min(),
+            "max": amounts.max()
         }
     
     def _tool_calculate_statistics(self, document_type: str) -> Dict:
         """Calculate comprehensive statistics"""
-        if document_type == "purchase_orders":
-            documents = list(self.workflow.purchase_orders.values())
-        elif document_type == "invoices":
-            documents = list(self.workflow.invoices.values())
-        elif document_type == "goods_receipts":
-            documents = list(self.workflow.goods_receipts.values())
-        else:
+        if document_type not in self._DOC_TYPES:
             return {"error": "Invalid document type"}
         
-        amounts = [doc.total_amount for doc in documents]
+        amounts = self._get_amounts(document_type)
         
-        if not amounts:
+        if not len(amounts):
             return {"error": "No documents found"}
         
+        (count, total, mean, median, std_dev, min_amount, max_amount,
+         p25, p50, p75, p95) = compute_stats(amounts)
+        
         return {
             "document_type": document_type,
-            "count": len(amounts),
-            "mean": round(np.mean(amounts), 2),
-            "median": round(np.median(amounts), 2),
-            "std_dev": round(np.std(amounts), 2),
-            "min": round(min(amounts), 2),
-            "max": round(max(amounts), 2),
-            "percentile_25": round(np.percentile(amounts, 25), 2),
-            "percentile_50": round(np.percentile(amounts, 50), 2),
-            "percentile_75": round(np.percentile(amounts, 75), 2),
-            "percentile_95": round(np.percentile(amounts, 95), 2),
-            "total": round(sum(amounts), 2)
+            "count": int(count),
+            "mean": round(mean, 2),
+            "median": round(median, 2),
+            "std_dev": round(std_dev, 2),
+            "min": round(min_amount, 2),
+            "max": round(max_amount, 2),
+            "percentile_25": round(p25, 2),
+            "percentile_50": round(p50, 2),
+            "percentile_75": round(p75, 2),
+            "percentile_95": round(p95, 2),
+            "total": round(total, 2)
         }
     
     def _tool_find_spending_trends(self, group_by: str) -> Dict:
         """Analyze spending trends"""
-        pos = list(self.workflow.purchase_orders.values())
-        
-        trends = {}
-        for po in pos:
-            if group_by == "department":
-                key = po.department
-            elif group_by == "vendor":
-                key = po.vendor_name
-            elif group_by == "month":
-                key = po.creation_date.strftime("%Y-%m")
-            else:
-                return {"error": "Invalid group_by parameter"}
-            
-            if key not in trends:
-                trends[key] = {"count": 0, "total": 0}
-            trends[key]["count"] += 1
-            trends[key]["total"] += po.total_amount
-        
-        sorted_trends = sorted(
-            [{"category": k, **v} for k, v in trends.items()],
-            key=lambda x: x["total"],
-            reverse=True
-        )
+        key_func = _TREND_KEYS.get(group_by)
+        if key_func is None:
+            return {"error": "Invalid group_by parameter"}
+        
+        pos = self.workflow.purchase_orders.values()
+        keys = [key_func(po) for po in pos]
+        amounts = np.fromiter((po.total_amount for po in pos), dtype=np.float64, count=len(pos))
+        
+        # Group by key: one sum/count per category, categories in first-seen order
+        _, first_idx, inverse = np.unique(np.array(keys, dtype=object), return_index=True, return_inverse=True)
+        totals = np.bincount(inverse, weights=amounts, minlength=len(first_idx))
+        counts = np.bincount(inverse, minlength=len(first_idx))
+        
+        averages = totals / counts
+        
+        # Top 10 by total descending (ties keep first-seen order)
+        order = np.lexsort((first_idx, -totals))[:10]
+        top_trends = [
+            {"category": keys[first_idx[i]], "count": int(counts[i]), "total": float(totals[i]),
+             "average": float(averages[i])}
+            for i in order
+        ]
         
         return {
             "group_by": group_by,
-            "categories": len(sorted_trends),
-            "trends": sorted_trends[:10]
+            "categories": len(first_idx),
+            "trends": top_trends
         }
     
     def _tool_predict_payment_date(self, invoice_id: str) -> Dict:
@@ -269,7 +741,7 @@ class P2PChatbotUltimate(P2PChatbotRAG):
                 "payment_date": invoice.payment_date.strftime("%Y-%m-%d") if invoice.payment_date else "N/A"
             }
         
-        days_until_due = (invoice.due_date - datetime.now()).days
+        days_until_due = (invoice.due_date - (self._now or datetime.now())).days
         
         if days_until_due < 0:
             prediction = "Overdue - immediate attention needed"
@@ -296,15 +768,11 @@ class P2PChatbotUltimate(P2PChatbotRAG):
         doc = None
         doc_type = None
         
-        if document_id in self.workflow.purchase_orders:
-            doc = self.workflow.purchase_orders[document_id]
-            doc_type = "Purchase Order"
-        elif document_id in self.workflow.invoices:
-            doc = self.workflow.invoices[document_id]
-            doc_type = "Invoice"
-        elif document_id in self.workflow.goods_receipts:
-            doc = self.workflow.goods_receipts[document_id]
-            doc_type = "Goods Receipt"
+        for store_name, _, label in self._DOC_TYPES.values():
+            doc = getattr(self.workflow, store_name).get(document_id)
+            if doc is not None:
+                doc_type = label
+                break
         
         if not doc:
             return {"error": "Document not found"}
@@ -319,191 +787,124 @@ class P2PChatbotUltimate(P2PChatbotRAG):
             risk_score += 1
             risk_factors.append("Medium value transaction")
         
-        if hasattr(doc, 'status'):
-            if doc.status.value == "Blocked":
-                risk_score += 5
-                risk_factors.append("Document is blocked")
-            elif doc.status.value == "Pending Approval":
-                risk_score += 2
-                risk_factors.append("Awaiting approval")
-        
-        if doc_type == "Invoice" and hasattr(doc, 'due_date'):
-            days_until_due = (doc.due_date - datetime.now()).days
-            if days_until_due < 0:
-                risk_score += 4
-                risk_factors.append(f"Overdue by {abs(days_until_due)} days")
-        
-        if risk_score >= 7:
-            risk_level = "CRITICAL"
-        elif risk_score >= 4:
-            risk_level = "HIGH"
-        elif risk_score >= 2:
-            risk_level = "MEDIUM"
-        else:
-            risk_level = "LOW"
-        
-        recommendations = {
-            "CRITICAL": "Immediate action required - escalate to management",
-            "HIGH": "Priority attention needed - review within 24 hours",
-            "MEDIUM": "Monitor closely - review within this week",
-            "LOW": "Normal processing - standard workflow"
-        }
-        
-        return {
-            "document_id": document_id,
-            "document_type": doc_type,
-            "risk_level": risk_level,
-            "risk_score": risk_score,
-            "risk_factors": risk_factors,
-            "recommendation": recommendations.get(risk_level, "Review as needed")
-        }
-    
-    # ==================== RESULT FORMATTING ====================
-    
-    def _format_outlier_result(self, result: Dict) -> str:
-        """Format outlier analysis with CSS-based box plot visualization"""
-        if "error" in result:
-            return f"❌ {result['error']}"
-        
-        # Get all documents for visualization
-        doc_type = result['document_type']
-        if doc_type == "purchase_orders":
-            documents = list(self.workflow.purchase_orders.values())
-        elif doc_type == "invoices":
-            documents = list(self.workflow.invoices.values())
-        else:
-            documents = list(self.workflow.goods_receipts.values())
-        
-        amounts = sorted([doc.total_amount for doc in documents])
-        mean = result['mean_amount']
-        std_dev = result['std_dev']
-        
-        # Calculate quartiles for box plot
-        import numpy as np
-        q1 = np.percentile(amounts, 25)
-        median = np.percentile(amounts, 50)
-        q3 = np.percentile(amounts, 75)
-        min_val = min(amounts)
-        max_val = max(amounts)
-        
-        # Upper and lower bounds for outliers
-        upper_bound = mean + (2 * std_dev)
-        lower_bound = max(0, mean - (2 * std_dev))
-        
-        # Create HTML visualization
-        doc_type_display = doc_type.replace('_', ' ').title()
-        html = f"""
-<div style="background: white; padding: 20px; border-radius: 8px; border: 1px solid #dee2e6; max-width: 800px;">
-    <h5 style="margin-top: 0;">📊 Outlier Analysis: {doc_type_display}</h5>
-    
-    <!-- Summary Cards -->
-    <div style="display: grid; grid-template-columns: repeat(4, 1fr); gap: 10px; margin: 20px 0;">
-        <div style="background: #e3f2fd; padding: 12px; border-radius: 6px; text-align: center;">
-            <div style="font-size: 24px; font-weight: bold; color: #1976d2;">{result['total_documents']}</div>
-            <div style="font-size: 11px; color: #666;">Total Documents</div>
-        </div>
-        <div style="background: #ffebee; padding: 12px; border-radius: 6px; text-align: center;">
-            <div style="font-size: 24px; font-weight: bold; color: #d32f2f;">{result['outliers_found']}</div>
-            <div style="font-size: 11px; color: #666;">Outliers Found</div>
-        </div>
-        <div style="background: #e8f5e9; padding: 12px; border-radius: 6px; text-align: center;">
-            <div style="font-size: 18px; font-weight: bold; color: #388e3c;">${mean:,.0f}</div>
-            <div style="font-size: 11px; color: #666;">Mean Amount</div>
-        </div>
-        <div style="background: #fff3e0; padding: 12px; border-radius: 6px; text-align: center;">
-            <div style="font-size: 18px; font-weight: bold; color: #f57c00;">${std_dev:,.0f}</div>
-            <div style="font-size: 11px; color: #666;">Std Deviation</div>
-        </div>
-    </div>
-    
-    <!-- Box Plot Visualization -->
-    <div style="margin: 30px 0;">
-        <h6 style="margin-bottom: 15px;">📦 Distribution Box Plot</h6>
-        <div style="position: relative; height: 120px; background: #f8f9fa; border-radius: 4px; padding: 20px;">
-            <!-- Scale line -->
-            <div style="position: absolute; top: 60px; left: 20px; right: 20px; height: 2px; background: #dee2e6;"></div>
-            
-            <!-- Min marker -->
-            <div style="position: absolute; top: 50px; left: 20px;">
-                <div style="width: 2px; height: 20px; background: #666; margin: 0 auto;"></div>
-                <div style="font-size: 10px; margin-top: 5px; white-space: nowrap;">${min_val:,.0f}</div>
-            </div>
-            
-            <!-- Box (Q1 to Q3) -->
-            <div style="position: absolute; top: 45px; left: calc(20px + {((q1-min_val)/(max_val-min_val)*100 if max_val>min_val else 0)}%); width: {((q3-q1)/(max_val-min_val)*100 if max_val>min_val else 20)}%; height: 30px; background: #90caf9; border: 2px solid #1976d2; border-radius: 4px;">
-                <!-- Median line -->
-                <div style="position: absolute; left: {((median-q1)/(q3-q1)*100 if q3>q1 else 50)}%; top: 0; bottom: 0; width: 3px; background: #d32f2f;"></div>
-            </div>
-            
-            <!-- Q1 label -->
-            <div style="position: absolute; top: 80px; left: calc(20px + {((q1-min_val)/(max_val-min_val)*100 if max_val>min_val else 0)}%); font-size: 10px; transform: translateX(-50%);">
-                Q1<br>${q1:,.0f}
-            </div>
-            
-            <!-- Median label -->
-            <div style="position: absolute; top: 25px; left: calc(20px + {((median-min_val)/(max_val-min_val)*100 if max_val>min_val else 10)}%); font-size: 10px; transform: translateX(-50%); color: #d32f2f; font-weight: bold;">
-                Median<br>${median:,.0f}
-            </div>
-            
-            <!-- Q3 label -->
-            <div style="position: absolute; top: 80px; left: calc(20px + {((q3-min_val)/(max_val-min_val)*100 if max_val>min_val else 20)}%); font-size: 10px; transform: translateX(-50%);">
-                Q3<br>${q3:,.0f}
-            </div>
-            
-            <!-- Max marker -->
-            <div style="position: absolute; top: 50px; right: 20px;">
-                <div style="width: 2px; height: 20px; background: #666; margin: 0 auto;"></div>
-                <div style="font-size: 10px; margin-top: 5px; white-space: nowrap;">${max_val:,.0f}</div>
-            </div>
-            
-            <!-- Outlier threshold lines -->
-            <div style="position: absolute; top: 35px; left: calc(20px + {((upper_bound-min_val)/(max_val-min_val)*100 if max_val>min_val else 80)}%); width: 2px; height: 50px; background: #ff5722; border-left: 2px dashed #ff5722;"></div>
-            <div style="position: absolute; top: 20px; left: calc(20px + {((upper_bound-min_val)/(max_val-min_val)*100 if max_val>min_val else 80)}%); font-size: 9px; color: #ff5722; white-space: nowrap; transform: translateX(-50%);">
-                +2σ
-            </div>
-        </div>
-        <div style="margin-top: 10px; font-size: 11px; color: #666;">
-            <span style="color: #1976d2;">█</span> Normal Range (Q1-Q3) &nbsp;
-            <span style="color: #d32f2f;">│</span> Median &nbsp;
-            <span style="color: #ff5722;">┊</span> Outlier Threshold (±2σ)
-        </div>
-    </div>
-"""
-        
+        if hasattr(doc, 'status'):
+            if doc.status.value == "Blocked":
+                risk_score += 5
+                risk_factors.append("Document is blocked")
+            elif doc.status.value == "Pending Approval":
+                risk_score += 2
+                risk_factors.append("Awaiting approval")
+        
+        if doc_type == "Invoice" and hasattr(doc, 'due_date'):
+            days_until_due = (doc.due_date - (self._now or datetime.now())).days
+            if days_until_due < 0:
+                risk_score += 4
+                risk_factors.append(f"Overdue by {abs(days_until_due)} days")
+        
+        if risk_score >= 7:
+            risk_level = "CRITICAL"
+        elif risk_score >= 4:
+            risk_level = "HIGH"
+        elif risk_score >= 2:
+            risk_level = "MEDIUM"
+        else:
+            risk_level = "LOW"
+        
+        return {
+            "document_id": document_id,
+            "document_type": doc_type,
+            "risk_level": risk_level,
+            "risk_score": risk_score,
+            "risk_factors": risk_factors,
+            "recommendation": _RISK_RECOMMENDATIONS.get(risk_level, "Review as needed")
+        }
+    
+    # ==================== RESULT FORMATTING ====================
+    
+    def _format_outlier_result(self, result: Dict) -> str:
+        """Format outlier analysis with CSS-based box plot visualization"""
+        if "error" in result:
+            return f"❌ {result['error']}"
+        
+        doc_type = result['document_type']
+        mean = result['mean_amount']
+        std_dev = result['std_dev']
+        
+        # Quartiles for box plot (computed by the tool)
+        q1 = result['q1']
+        median = result['median']
+        q3 = result['q3']
+        min_val = result['min']
+        max_val = result['max']
+        
+        # Upper bound for outliers, and box-plot positions as % of the range
+        upper_bound = mean + (2 * std_dev)
+        span = max_val - min_val
+        if span > 0:
+            q1_pct = (q1 - min_val) / span * 100
+            box_width_pct = (q3 - q1) / span * 100
+            median_pct = (median - min_val) / span * 100
+            q3_pct = (q3 - min_val) / span * 100
+            upper_pct = (upper_bound - min_val) / span * 100
+        else:
+            q1_pct, box_width_pct, median_pct, q3_pct, upper_pct = 0, 20, 10, 20, 80
+        median_box_pct = (median - q1) / (q3 - q1) * 100 if q3 > q1 else 50
+        
+        # Create HTML visualization
+        parts = [_outlier_html(
+            doc_type_display=doc_type.replace('_', ' ').title(),
+            total_documents=result['total_documents'],
+            outliers_found=result['outliers_found'],
+            mean=mean,
+            std_dev=std_dev,
+            min_val=min_val,
+            max_val=max_val,
+            q1=q1,
+            median=median,
+            q3=q3,
+            q1_pct=q1_pct,
+            box_width_pct=box_width_pct,
+            median_box_pct=median_box_pct,
+            median_pct=median_pct,
+            q3_pct=q3_pct,
+            upper_pct=upper_pct
+        )]
+        
         # Add outlier details
         if result['outliers_found'] > 0:
-            html += """
+            parts.append("""
     <div style="margin-top: 25px;">
         <h6>⚠️ Detected Outliers (Top 5)</h6>
         <div style="background: #fff3cd; border-left: 4px solid #ffc107; padding: 15px; margin: 10px 0;">
-"""
+""")
+            parts.append(_OUTLIER_ROW_STYLE)
             for i, outlier in enumerate(result['outliers'][:5], 1):
-                html += f"""
-            <div style="display: flex; justify-content: space-between; align-items: center; padding: 8px 0; border-bottom: 1px solid #ffe082;">
-                <div style="flex: 1;">
-                    <strong style="color: #f57c00;">{i}. {outlier['number']}</strong>
-                    <span style="font-size: 12px; color: #666;"> - {outlier['vendor']}</span>
+                parts.append(f"""
+            <div class="p2p-outlier">
+                <div class="p2p-outlier-doc">
+                    <strong>{i}. {outlier['number']}</strong>
+                    <span> - {outlier['vendor']}</span>
                 </div>
-                <div style="text-align: right;">
-                    <div style="font-size: 18px; font-weight: bold; color: #d32f2f;">${outlier['amount']:,.2f}</div>
-                    <div style="font-size: 11px; color: #f57c00;">{outlier['z_score']}σ from mean</div>
+                <div class="p2p-outlier-amt">
+                    <div>${outlier['amount']:,.2f}</div>
+                    <div>{outlier['z_score']}σ from mean</div>
                 </div>
             </div>
-"""
-            html += """
+""")
+            parts.append("""
         </div>
     </div>
-"""
+""")
         else:
-            html += """
+            parts.append("""
     <div style="background: #d4edda; border-left: 4px solid #28a745; padding: 15px; margin: 20px 0; border-radius: 4px;">
         <strong style="color: #155724;">✅ No Outliers Detected!</strong><br>
         <span style="font-size: 13px; color: #155724;">All documents are within the normal range (±2 standard deviations from mean).</span>
     </div>
-"""
+""")
         
-        html += "</div>"
-        return html
+        parts.append("</div>")
+        return "".join(parts)
     
     def _format_statistics_result(self, result: Dict) -> str:
         """Format statistics"""
@@ -533,9 +934,6 @@ class P2PChatbotUltimate(P2PChatbotRAG):
         if "error" in result:
             return f"❌ {result['error']}"
         
-        import json
-        import uuid
-        
         chart_id = f"chart-{uuid.uuid4().hex[:8]}"
         group_by = result['group_by']
         
@@ -552,7 +950,7 @@ class P2PChatbotUltimate(P2PChatbotRAG):
             chart_type = "bar"  # Categories = bar chart
             x_label = group_by.title()
         
-        html = f"""
+        parts = [f"""
 <div style="background: white; padding: 20px; border-radius: 8px; border: 1px solid #dee2e6; max-width: 800px;">
     <h5 style="margin-top: 0;">📈 Spending Trends by {group_by.title()}</h5>
     
@@ -644,46 +1042,45 @@ class P2PChatbotUltimate(P2PChatbotRAG):
     <!-- Top Categories Table -->
     <div style="margin-top: 25px;">
         <h6>Top {min(len(result['trends']), 10)} {group_by.title()}s</h6>
-        <table style="width: 100%; font-size: 0.9em; border-collapse: collapse;">
-            <thead style="background: #f8f9fa;">
+        {_TREND_TABLE_STYLE}
+        <table class="p2p-trends">
+            <thead>
                 <tr>
-                    <th style="padding: 8px; text-align: left; border-bottom: 2px solid #dee2e6;">#</th>
-                    <th style="padding: 8px; text-align: left; border-bottom: 2px solid #dee2e6;">{group_by.title()}</th>
-                    <th style="padding: 8px; text-align: right; border-bottom: 2px solid #dee2e6;">Total</th>
-                    <th style="padding: 8px; text-align: center; border-bottom: 2px solid #dee2e6;">Count</th>
-                    <th style="padding: 8px; text-align: right; border-bottom: 2px solid #dee2e6;">Average</th>
+                    <th>#</th>
+                    <th>{group_by.title()}</th>
+                    <th class="p2p-r">Total</th>
+                    <th class="p2p-c">Count</th>
+                    <th class="p2p-r">Average</th>
                 </tr>
             </thead>
             <tbody>
-"""
+"""]
         
         for i, trend in enumerate(result['trends'][:10], 1):
-            avg = trend['total'] / trend['count']
-            html += f"""
-                <tr style="{'background: #f8f9fa;' if i % 2 == 0 else ''}">
-                    <td style="padding: 8px; border-bottom: 1px solid #dee2e6;">{i}</td>
-                    <td style="padding: 8px; border-bottom: 1px solid #dee2e6;"><strong>{trend['category']}</strong></td>
-                    <td style="padding: 8px; text-align: right; border-bottom: 1px solid #dee2e6; color: #1976d2; font-weight: bold;">${trend['total']:,.2f}</td>
-                    <td style="padding: 8px; text-align: center; border-bottom: 1px solid #dee2e6;">{trend['count']}</td>
-                    <td style="padding: 8px; text-align: right; border-bottom: 1px solid #dee2e6;">${avg:,.2f}</td>
+            avg = trend['average']
+            parts.append(f"""
+                <tr>
+                    <td>{i}</td>
+                    <td><strong>{trend['category']}</strong></td>
+                    <td class="p2p-r p2p-total">${trend['total']:,.2f}</td>
+                    <td class="p2p-c">{trend['count']}</td>
+                    <td class="p2p-r">${avg:,.2f}</td>
                 </tr>
-"""
+""")
         
-        html += """
+        parts.append("""
             </tbody>
         </table>
     </div>
 </div>
-"""
+""")
         
-        return html
+        return "".join(parts)
     
     def _handle_why_question(self, message: str) -> dict:
         """Override to use KG reasoning for blocked documents"""
-        from chatbot_tools import P2PChatbotWithTools
-        
         # Check if asking about blocked documents
-        if 'blocked' in message.lower():
+        if 'blocked' in self._normalize(message):
             # Extract document ID
             words = message.split()
             doc_id = None
@@ -691,42 +1088,21 @@ class P2PChatbotUltimate(P2PChatbotRAG):
             for word in words:
                 word_upper = word.upper()
                 # Look for document IDs (they contain hyphens)
-                if '-' in word or any(prefix in word_upper for prefix in ['INV-', 'PO-', 'GR-', 'INV', 'PO', 'GR']):
-                    # Try to find the exact document
-                    # Check invoices
-                    for inv in self.workflow.invoices.values():
-                        if word_upper in inv.invoice_number or word_upper in inv.id:
-                            doc_id = inv.id
-                            break
-                    if doc_id:
-                        break
-                    
-                    # Check POs
-                    for po in self.workflow.purchase_orders.values():
-                        if word_upper in po.po_number or word_upper in po.id:
-                            doc_id = po.id
-                            break
-                    if doc_id:
-                        break
-                    
-                    # Check GRs
-                    for gr in self.workflow.goods_receipts.values():
-                        if word_upper in gr.gr_number or word_upper in gr.id:
-                            doc_id = gr.id
-                            break
+                if _DOC_TOKEN_RE.search(word_upper):
+                    doc_id = self._find_document_id(word_upper)
                     if doc_id:
                         break
             
             # If we found a document ID, use KG reasoning tool
             if doc_id:
-                # Create temporary tool chatbot to access the explain function
-                tool_bot = P2PChatbotWithTools(self.workflow)
+                # Tool chatbot gives access to the explain function
+                tool_bot = self._get_tool_bot()
                 result = tool_bot._tool_explain_blocked_document(doc_id)
                 return {'message': tool_bot._format_blocked_explanation(result)}
             else:
                 # No specific document found, show all blocked documents
-                blocked = self.workflow.get_blocked_documents()
-                if any(blocked.values()):
+                blocked = self._blocked_snapshot()
+                if blocked['invoices'] or blocked['purchase_orders'] or blocked['goods_receipts']:
                     response = "🚫 **Blocked Documents Found:**\n\n"
                     
                     if blocked['invoices']:
@@ -756,259 +1132,114 @@ class P2PChatbotUltimate(P2PChatbotRAG):
         # If not asking about blocked, fall back to parent's search
         return super()._handle_why_question(message)
     
+    def _get_doc_index(self):
+        """
+        Document lookup tables for _handle_why_question, rebuilt when the workflow version changes
+        Returns (number/id -> doc id, newline-joined numbers/ids, start offset of each, doc id of each)
+        """
+        if self._doc_index is None or self._doc_index_version != self.workflow.version:
+            exact = {}
+            keys = []
+            ids = []
+            for doc_type in ("invoices", "purchase_orders", "goods_receipts"):
+                store_name, number_attr, _ = self._DOC_TYPES[doc_type]
+                for doc in getattr(self.workflow, store_name).values():
+                    for key in (getattr(doc, number_attr), doc.id):
+                        exact.setdefault(key, doc.id)
+                        keys.append(key)
+                        ids.append(doc.id)
+            starts = list(accumulate((len(key) + 1 for key in keys[:-1]), initial=0))
+            self._doc_index = (exact, "\n".join(keys), starts, ids)
+            self._doc_index_version = self.workflow.version
+        return self._doc_index
+    
+    def _get_tool_bot(self) -> P2PChatbotWithTools:
+        """Tool chatbot over the same workflow, created on first use"""
+        if self._tool_bot is None or self._tool_bot.workflow is not self.workflow:
+            self._tool_bot = P2PChatbotWithTools(self.workflow)
+        return self._tool_bot
+    
+    def _blocked_snapshot(self) -> Dict[str, list]:
+        """workflow.get_blocked_documents(), recomputed only when the workflow version changes"""
+        if self._blocked_cache is None or self._blocked_cache_version != self.workflow.version:
+            self._blocked_cache = self.workflow.get_blocked_documents()
+            self._blocked_cache_version = self.workflow.version
+        return self._blocked_cache
+    
+    def _find_document_id(self, word_upper: str) -> Optional[str]:
+        """
+        Id of the document whose number or id is word_upper
+        Falls back to the first invoice, PO, then GR whose number or id contains it
+        """
+        exact, keys, starts, ids = self._get_doc_index()
+        doc_id = exact.get(word_upper)
+        if doc_id is None:
+            pos = keys.find(word_upper)
+            if pos >= 0:
+                doc_id = ids[bisect_right(starts, pos) - 1]
+        return doc_id
+    
     def _format_blocked_invoice_analysis(self, inv) -> str:
         """Format blocked invoice analysis with rich HTML"""
         # Get related PO for analysis
         po = self.workflow.purchase_orders.get(inv.po_id)
         
-        html = f"""
-<div style="background: white; padding: 20px; border-radius: 8px; border: 1px solid #dee2e6; max-width: 800px;">
-    <h5 style="margin-top: 0;">🚫 Why is {inv.invoice_number} Blocked?</h5>
-    
-    <!-- Document Info Card -->
-    <div style="background: #ffebee; padding: 15px; border-radius: 6px; margin: 15px 0; border-left: 4px solid #d32f2f;">
-        <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 15px;">
-            <div>
-                <div style="font-size: 11px; color: #666; text-transform: uppercase;">Invoice Number</div>
-                <div style="font-size: 18px; font-weight: bold; color: #d32f2f;">{inv.invoice_number}</div>
-            </div>
-            <div>
-                <div style="font-size: 11px; color: #666; text-transform: uppercase;">Vendor</div>
-                <div style="font-size: 16px; font-weight: bold; color: #333;">{inv.vendor_name}</div>
-            </div>
-            <div>
-                <div style="font-size: 11px; color: #666; text-transform: uppercase;">Amount</div>
-                <div style="font-size: 18px; font-weight: bold; color: #d32f2f;">${inv.total_amount:,.2f}</div>
-            </div>
-            <div>
-                <div style="font-size: 11px; color: #666; text-transform: uppercase;">Status</div>
-                <div style="font-size: 16px; font-weight: bold; color: #d32f2f;">{inv.status.value}</div>
-            </div>
-        </div>
-    </div>
-    
-    <!-- Blocked Reason -->
-    <div style="background: #fff3cd; padding: 15px; border-radius: 6px; margin: 15px 0; border-left: 4px solid #ffc107;">
-        <h6 style="margin-top: 0; color: #856404;">🚫 Blocked Reason</h6>
-        <p style="margin: 0; font-size: 14px; color: #856404;"><strong>{inv.blocked_reason}</strong></p>
-    </div>
-    
-    <!-- Root Cause Analysis -->
-    <div style="margin: 20px 0;">
-        <h6>📊 Root Cause Analysis</h6>
-"""
+        parts = [_invoice_header_html(inv)]
         
-        # Analyze based on blocked reason
-        if "pricing" in inv.blocked_reason.lower() or "price" in inv.blocked_reason.lower():
+        # Analyze based on blocked reason (classified once per reason on the invoice)
+        category = inv.blocked_category
+        if category is BlockedCategory.PRICE:
             if po:
-                po_total = po.total_amount
-                inv_total = inv.total_amount
-                diff = abs(po_total - inv_total)
-                variance = (diff / po_total * 100) if po_total > 0 else 0
-                
-                severity_color = "#d32f2f" if variance > 10 else "#f57c00" if variance > 5 else "#fbc02d"
-                severity_label = "HIGH" if variance > 10 else "MEDIUM" if variance > 5 else "LOW"
-                
-                html += f"""
-        <div style="background: #f8f9fa; padding: 15px; border-radius: 6px; margin-bottom: 15px;">
-            <strong style="color: #d32f2f;">💰 Price Discrepancy Detected</strong>
-            <div style="margin-top: 10px; display: grid; grid-template-columns: repeat(3, 1fr); gap: 10px;">
-                <div style="background: white; padding: 10px; border-radius: 4px; text-align: center;">
-                    <div style="font-size: 11px; color: #666;">PO Amount</div>
-                    <div style="font-size: 18px; font-weight: bold; color: #1976d2;">${po_total:,.2f}</div>
-                </div>
-                <div style="background: white; padding: 10px; border-radius: 4px; text-align: center;">
-                    <div style="font-size: 11px; color: #666;">Invoice Amount</div>
-                    <div style="font-size: 18px; font-weight: bold; color: #d32f2f;">${inv_total:,.2f}</div>
-                </div>
-                <div style="background: white; padding: 10px; border-radius: 4px; text-align: center;">
-                    <div style="font-size: 11px; color: #666;">Variance</div>
-                    <div style="font-size: 18px; font-weight: bold; color: {severity_color};">{variance:.1f}%</div>
-                </div>
-            </div>
-            <div style="margin-top: 10px; padding: 10px; background: {'#ffebee' if variance > 10 else '#fff3e0' if variance > 5 else '#fffde7'}; border-radius: 4px;">
-                <strong style="color: {severity_color};">Severity: {severity_label}</strong>
-                <div style="font-size: 13px; color: #666; margin-top: 5px;">
-                    {f'Variance exceeds 10% tolerance - immediate attention required' if variance > 10 else f'Variance exceeds 5% tolerance - review needed' if variance > 5 else 'Minor variance detected'}
-                </div>
-            </div>
-        </div>
-"""
-        
-        elif "three-way" in inv.blocked_reason.lower() or "matching" in inv.blocked_reason.lower():
-            html += f"""
-        <div style="background: #f8f9fa; padding: 15px; border-radius: 6px; margin-bottom: 15px;">
-            <strong style="color: #d32f2f;">🔗 Three-Way Matching Failure</strong>
-            <div style="margin-top: 15px;">
-                <div style="margin: 10px 0; padding: 10px; background: white; border-radius: 4px; border-left: 3px solid #1976d2;">
-                    <strong>1. Purchase Order:</strong> {inv.po_number}
-                </div>
-                <div style="margin: 10px 0; padding: 10px; background: white; border-radius: 4px; border-left: 3px solid #388e3c;">
-                    <strong>2. Goods Receipt:</strong> {inv.gr_number}
-                </div>
-                <div style="margin: 10px 0; padding: 10px; background: white; border-radius: 4px; border-left: 3px solid #d32f2f;">
-                    <strong>3. Invoice:</strong> {inv.invoice_number}
-                </div>
-            </div>
-        </div>
-"""
+                parts.append(_price_discrepancy_html(po.total_amount, inv.total_amount))
+        elif category is not BlockedCategory.OTHER:
+            parts.append(_three_way_html(inv))
         
         # Action Required Section
-        html += """
-        <div style="background: #e3f2fd; padding: 15px; border-radius: 6px; border-left: 4px solid #1976d2; margin-top: 15px;">
-            <h6 style="margin-top: 0; color: #1976d2;">✅ Action Required</h6>
-            <ul style="margin: 0; padding-left: 20px; color: #1565c0;">
-"""
-        
-        if "pricing" in inv.blocked_reason.lower() or "price" in inv.blocked_reason.lower():
-            html += """
-                <li style="margin: 8px 0;">Validate invoice line items against Purchase Order</li>
-                <li style="margin: 8px 0;">Contact vendor for corrected invoice or approve variance</li>
-                <li style="margin: 8px 0;"><strong>Contact:</strong> Accounts Payable and vendor</li>
-"""
-        elif "three-way" in inv.blocked_reason.lower():
-            html += """
-                <li style="margin: 8px 0;">Verify all documents match (PO, GR, Invoice)</li>
-                <li style="margin: 8px 0;">Reconcile discrepancies between documents</li>
-                <li style="margin: 8px 0;"><strong>Contact:</strong> Procurement, Warehouse, and AP teams</li>
-"""
-        else:
-            html += """
-                <li style="margin: 8px 0;">Investigate and resolve blocking issue</li>
-                <li style="margin: 8px 0;">Review invoice details and unblock</li>
-                <li style="margin: 8px 0;"><strong>Contact:</strong> Accounts Payable manager</li>
-"""
-        
-        html += """
-            </ul>
-        </div>
-"""
+        parts.append(_ACTION_HTML[category])
         
         # Urgency indicator if due date approaching
         if inv.due_date:
-            from datetime import datetime
-            now = datetime.now()
-            days_until_due = (inv.due_date - now).days
-            
-            if days_until_due < 0:
-                html += f"""
-        <div style="background: #d32f2f; color: white; padding: 15px; border-radius: 6px; margin-top: 15px; text-align: center;">
-            <strong style="font-size: 16px;">⚠️ URGENT: Invoice is {abs(days_until_due)} days overdue!</strong>
-            <div style="font-size: 13px; margin-top: 5px;">Immediate action required to avoid penalties</div>
-        </div>
-"""
-            elif days_until_due < 7:
-                html += f"""
-        <div style="background: #f57c00; color: white; padding: 15px; border-radius: 6px; margin-top: 15px; text-align: center;">
-            <strong style="font-size: 16px;">⚡ Priority: Invoice due in {days_until_due} days</strong>
-            <div style="font-size: 13px; margin-top: 5px;">Please expedite resolution</div>
-        </div>
-"""
+            parts.append(_urgency_html((inv.due_date - (self._now or datetime.now())).days))
         
-        html += """
-    </div>
-</div>
-"""
+        parts.append(_INVOICE_CARD_CLOSE_HTML)
         
-        return html
+        return "".join(parts)
     
     def _format_blocked_po_analysis(self, po) -> str:
         """Format blocked PO analysis with rich HTML"""
-        html = f"""
-<div style="background: white; padding: 20px; border-radius: 8px; border: 1px solid #dee2e6; max-width: 800px;">
-    <h5 style="margin-top: 0;">🚫 Why is {po.po_number} Blocked?</h5>
-    
-    <div style="background: #ffebee; padding: 15px; border-radius: 6px; margin: 15px 0; border-left: 4px solid #d32f2f;">
-        <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 15px;">
-            <div>
-                <div style="font-size: 11px; color: #666;">PO Number</div>
-                <div style="font-size: 18px; font-weight: bold; color: #d32f2f;">{po.po_number}</div>
-            </div>
-            <div>
-                <div style="font-size: 11px; color: #666;">Vendor</div>
-                <div style="font-size: 16px; font-weight: bold;">{po.vendor_name}</div>
-            </div>
-            <div>
-                <div style="font-size: 11px; color: #666;">Amount</div>
-                <div style="font-size: 18px; font-weight: bold; color: #d32f2f;">${po.total_amount:,.2f}</div>
-            </div>
-            <div>
-                <div style="font-size: 11px; color: #666;">Blocked Reason</div>
-                <div style="font-size: 14px; font-weight: bold; color: #856404;">{po.blocked_reason}</div>
-            </div>
-        </div>
-    </div>
-    
-    <div style="background: #e3f2fd; padding: 15px; border-radius: 6px; margin-top: 15px;">
-        <h6 style="margin-top: 0;">✅ Action Required</h6>
-        <p style="margin: 0;">Review and resolve blocking issue. Contact department manager or procurement team.</p>
-    </div>
-</div>
-"""
-        return html
+        return _blocked_doc_html(
+            number=po.po_number,
+            number_label="PO Number",
+            related=po.vendor_name,
+            related_label="Vendor",
+            amount=po.total_amount,
+            reason=po.blocked_reason,
+            action="Review and resolve blocking issue. Contact department manager or procurement team."
+        )
     
     def _format_blocked_gr_analysis(self, gr) -> str:
         """Format blocked GR analysis with rich HTML"""
-        html = f"""
-<div style="background: white; padding: 20px; border-radius: 8px; border: 1px solid #dee2e6; max-width: 800px;">
-    <h5 style="margin-top: 0;">🚫 Why is {gr.gr_number} Blocked?</h5>
-    
-    <div style="background: #ffebee; padding: 15px; border-radius: 6px; margin: 15px 0; border-left: 4px solid #d32f2f;">
-        <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 15px;">
-            <div>
-                <div style="font-size: 11px; color: #666;">GR Number</div>
-                <div style="font-size: 18px; font-weight: bold; color: #d32f2f;">{gr.gr_number}</div>
-            </div>
-            <div>
-                <div style="font-size: 11px; color: #666;">Related PO</div>
-                <div style="font-size: 16px; font-weight: bold;">{gr.po_number}</div>
-            </div>
-            <div>
-                <div style="font-size: 11px; color: #666;">Amount</div>
-                <div style="font-size: 18px; font-weight: bold; color: #d32f2f;">${gr.total_amount:,.2f}</div>
-            </div>
-            <div>
-                <div style="font-size: 11px; color: #666;">Blocked Reason</div>
-                <div style="font-size: 14px; font-weight: bold; color: #856404;">{gr.blocked_reason}</div>
-            </div>
-        </div>
-    </div>
-    
-    <div style="background: #e3f2fd; padding: 15px; border-radius: 6px; margin-top: 15px;">
-        <h6 style="margin-top: 0;">✅ Action Required</h6>
-        <p style="margin: 0;">Investigate and resolve blocking issue. Contact warehouse manager or receiving team.</p>
-    </div>
-</div>
-"""
-        return html
+        return _blocked_doc_html(
+            number=gr.gr_number,
+            number_label="GR Number",
+            related=gr.po_number,
+            related_label="Related PO",
+            amount=gr.total_amount,
+            reason=gr.blocked_reason,
+            action="Investigate and resolve blocking issue. Contact warehouse manager or receiving team."
+        )
     
     def _format_risk_result(self, result: Dict) -> str:
         """Format risk assessment with visual gauge"""
         if "error" in result:
             return f"❌ {result['error']}"
         
-        # Color coding based on risk level
-        risk_colors = {
-            "CRITICAL": "#d32f2f",
-            "HIGH": "#f57c00",
-            "MEDIUM": "#fbc02d",
-            "LOW": "#388e3c"
-        }
-        
-        risk_icons = {
-            "CRITICAL": "🔴",
-            "HIGH": "🟠",
-            "MEDIUM": "🟡",
-            "LOW": "🟢"
-        }
-        
-        color = risk_colors.get(result['risk_level'], "#9e9e9e")
-        icon = risk_icons.get(result['risk_level'], "⚪")
+        color, icon, rec_bg, rec_bdr = _RISK_TABLE.get(result['risk_level'], _RISK_DEFAULT)
         score = result['risk_score']
         max_score = 10
         percentage = (score / max_score) * 100
         
-        html = f"""
+        parts = [f"""
 <div style="background: white; padding: 20px; border-radius: 8px; border: 1px solid #dee2e6; max-width: 700px;">
     <h5 style="margin-top: 0;">{icon} Risk Assessment: {result['document_type']}</h5>
     
@@ -1040,16 +1271,7 @@ class P2PChatbotUltimate(P2PChatbotRAG):
             <div style="position: absolute; bottom: 30px; left: 20px; right: 20px; height: 30px; background: #e0e0e0; border-radius: 15px; overflow: hidden;">
                 <div style="height: 100%; width: {percentage}%; background: linear-gradient(90deg, #388e3c 0%, #fbc02d 50%, #f57c00 75%, #d32f2f 100%); transition: width 0.5s;"></div>
             </div>
-            
-            <!-- Risk labels -->
-            <div style="position: absolute; bottom: 5px; left: 20px; right: 20px; display: flex; justify-content: space-between; font-size: 10px; color: #666;">
-                <span>🟢 LOW</span>
-                <span>🟡 MEDIUM</span>
-                <span>🟠 HIGH</span>
-                <span>🔴 CRITICAL</span>
-            </div>
-        </div>
-        
+            """, _RISK_GAUGE_LABELS_HTML, f"""
         <!-- Risk Level Badge -->
         <div style="text-align: center; margin-top: 15px;">
             <div style="display: inline-block; background: {color}; color: white; padding: 8px 20px; border-radius: 20px; font-weight: bold; font-size: 16px;">
@@ -1057,42 +1279,17 @@ class P2PChatbotUltimate(P2PChatbotRAG):
             </div>
         </div>
     </div>
-"""
+"""]
         
         # Risk Factors
         if result['risk_factors']:
-            html += """
-    <div style="margin: 25px 0;">
-        <h6>⚠️ Risk Factors</h6>
-        <div style="background: #fff3cd; border-left: 4px solid #ffc107; padding: 15px; border-radius: 4px;">
-            <ul style="margin: 0; padding-left: 20px;">
-"""
+            parts.append(_RISK_FACTORS_OPEN_HTML)
             for factor in result['risk_factors']:
-                html += f"                <li style='margin: 8px 0; color: #856404;'>{factor}</li>\n"
-            html += """
-            </ul>
-        </div>
-    </div>
-"""
+                parts.append(f"                <li style='margin: 8px 0; color: #856404;'>{factor}</li>\n")
+            parts.append(_RISK_FACTORS_CLOSE_HTML)
         
         # Recommendation
-        rec_colors = {
-            "CRITICAL": "#ffebee",
-            "HIGH": "#fff3e0",
-            "MEDIUM": "#fffde7",
-            "LOW": "#e8f5e9"
-        }
-        rec_border = {
-            "CRITICAL": "#d32f2f",
-            "HIGH": "#f57c00",
-            "MEDIUM": "#fbc02d",
-            "LOW": "#388e3c"
-        }
-        
-        rec_bg = rec_colors.get(result['risk_level'], "#f5f5f5")
-        rec_bdr = rec_border.get(result['risk_level'], "#9e9e9e")
-        
-        html += f"""
+        parts.append(f"""
     <div style="margin: 25px 0;">
         <h6>💡 Recommendation</h6>
         <div style="background: {rec_bg}; border-left: 4px solid {rec_bdr}; padding: 15px; border-radius: 4px;">
@@ -1100,9 +1297,9 @@ class P2PChatbotUltimate(P2PChatbotRAG):
         </div>
     </div>
 </div>
-"""
+""")
         
-        return html
+        return "".join(parts)
 
 
 def create_chatbot(workflow, llm_backend="transformers", tools_enabled=False):
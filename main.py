@@ -1,6 +1,10 @@
 """
 Main application with CLI interface for P2P workflow prototype
 """
+import sys
+from itertools import chain
+from typing import Callable, Dict, Iterable, Iterator
+
 from workflow import P2PWorkflow
 from sample_data import generate_sample_data
 from models import POStatus, GRStatus, InvoiceStatus
@@ -14,99 +18,122 @@ def print_header(title: str):
     print("=" * 80)
 
 
-def print_po_details(po):
-    """Print purchase order details"""
-    print(f"\nPurchase Order: {po.po_number}")
-    print(f"  Vendor: {po.vendor_name} (ID: {po.vendor_id})")
-    print(f"  Requester: {po.requester} ({po.department})")
-    print(f"  Status: {po.status.value}")
-    print(f"  Creation Date: {po.creation_date.strftime('%Y-%m-%d %H:%M')}")
-    print(f"  Payment Terms: {po.payment_terms.value}")
-    print(f"  Delivery Address: {po.delivery_address}")
-    
-    print(f"\n  Line Items:")
+def _po_lines(po) -> Iterator[str]:
+    """Lines of the purchase order detail view"""
+    yield f"\nPurchase Order: {po.po_number}"
+    yield f"  Vendor: {po.vendor_name} (ID: {po.vendor_id})"
+    yield f"  Requester: {po.requester} ({po.department})"
+    yield f"  Status: {po.status}"
+    yield f"  Creation Date: {po.creation_date.strftime('%Y-%m-%d %H:%M')}"
+    yield f"  Payment Terms: {po.payment_terms}"
+    yield f"  Delivery Address: {po.delivery_address}"
+    
+    yield f"\n  Line Items:"
     for item in po.line_items:
-        print(f"    - {item.description}")
-        print(f"      Code: {item.item_code} | Qty: {item.quantity} | Unit Price: ${item.unit_price:.2f}")
-        print(f"      Subtotal: ${item.subtotal:.2f} | Tax: ${item.tax_amount:.2f} | Total: ${item.total:.2f}")
+        yield f"    - {item.description}"
+        yield f"      Code: {item.item_code} | Qty: {item.quantity} | Unit Price: ${item.unit_price:.2f}"
+        yield f"      Subtotal: ${item.subtotal:.2f} | Tax: ${item.tax_amount:.2f} | Total: ${item.total:.2f}"
     
-    print(f"\n  Financial Summary:")
-    print(f"    Subtotal: ${po.subtotal:.2f}")
-    print(f"    Tax Total: ${po.tax_total:.2f}")
-    print(f"    Total Amount: ${po.total_amount:.2f}")
+    yield f"\n  Financial Summary:"
+    yield f"    Subtotal: ${po.subtotal:.2f}"
+    yield f"    Tax Total: ${po.tax_total:.2f}"
+    yield f"    Total Amount: ${po.total_amount:.2f}"
     
     if po.approvals:
-        print(f"\n  Approval History:")
+        yield f"\n  Approval History:"
         for approval in po.approvals:
-            print(f"    - {approval.approver}: {approval.status}")
+            yield f"    - {approval.approver}: {approval.status}"
             if approval.comments:
-                print(f"      Comment: {approval.comments}")
-            print(f"      Timestamp: {approval.timestamp.strftime('%Y-%m-%d %H:%M')}")
+                yield f"      Comment: {approval.comments}"
+            yield f"      Timestamp: {approval.timestamp.strftime('%Y-%m-%d %H:%M')}"
     
     if po.notes:
-        print(f"\n  Notes: {po.notes}")
+        yield f"\n  Notes: {po.notes}"
 
 
-def print_gr_details(gr):
-    """Print goods receipt details"""
-    print(f"\nGoods Receipt: {gr.gr_number}")
-    print(f"  Related PO: {gr.po_number}")
-    print(f"  Status: {gr.status.value}")
-    print(f"  Receipt Date: {gr.receipt_date.strftime('%Y-%m-%d %H:%M')}")
-    print(f"  Received By: {gr.received_by}")
-    
-    print(f"\n  Line Items:")
+def print_po_details(po):
+    """Print purchase order details"""
+    sys.stdout.write("\n".join(_po_lines(po)) + "\n")
+
+
+def _gr_lines(gr) -> Iterator[str]:
+    """Lines of the goods receipt detail view"""
+    yield f"\nGoods Receipt: {gr.gr_number}"
+    yield f"  Related PO: {gr.po_number}"
+    yield f"  Status: {gr.status}"
+    yield f"  Receipt Date: {gr.receipt_date.strftime('%Y-%m-%d %H:%M')}"
+    yield f"  Received By: {gr.received_by}"
+    
+    yield f"\n  Line Items:"
     for item in gr.line_items:
-        print(f"    - {item.description}")
-        print(f"      Code: {item.item_code} | Qty: {item.quantity} | Total: ${item.total:.2f}")
+        yield f"    - {item.description}"
+        yield f"      Code: {item.item_code} | Qty: {item.quantity} | Total: ${item.total:.2f}"
     
-    print(f"\n  Total Amount: ${gr.total_amount:.2f}")
+    yield f"\n  Total Amount: ${gr.total_amount:.2f}"
     
     if gr.quality_checked:
-        print(f"\n  Quality Check:")
-        print(f"    Performed by: {gr.quality_checker}")
-        print(f"    Date: {gr.quality_check_date.strftime('%Y-%m-%d %H:%M')}")
-        print(f"    Result: {'PASSED' if gr.status == GRStatus.ACCEPTED else 'FAILED'}")
+        yield f"\n  Quality Check:"
+        yield f"    Performed by: {gr.quality_checker}"
+        yield f"    Date: {gr.quality_check_date.strftime('%Y-%m-%d %H:%M')}"
+        yield f"    Result: {'PASSED' if gr.status == GRStatus.ACCEPTED else 'FAILED'}"
     
     if gr.notes:
-        print(f"\n  Notes: {gr.notes}")
+        yield f"\n  Notes: {gr.notes}"
 
 
-def print_invoice_details(invoice):
-    """Print invoice details"""
-    print(f"\nInvoice: {invoice.invoice_number}")
-    print(f"  Vendor: {invoice.vendor_name} (ID: {invoice.vendor_id})")
-    print(f"  Related PO: {invoice.po_number}")
-    print(f"  Related GR: {invoice.gr_number}")
-    print(f"  Status: {invoice.status.value}")
-    print(f"  Invoice Date: {invoice.invoice_date.strftime('%Y-%m-%d')}")
-    print(f"  Due Date: {invoice.due_date.strftime('%Y-%m-%d')}")
-    print(f"  Payment Terms: {invoice.payment_terms.value}")
+def print_gr_details(gr):
+    """Print goods receipt details"""
+    sys.stdout.write("\n".join(_gr_lines(gr)) + "\n")
+
+
+def _invoice_lines(invoice) -> Iterator[str]:
+    """Lines of the invoice detail view"""
+    yield f"\nInvoice: {invoice.invoice_number}"
+    yield f"  Vendor: {invoice.vendor_name} (ID: {invoice.vendor_id})"
+    yield f"  Related PO: {invoice.po_number}"
+    yield f"  Related GR: {invoice.gr_number}"
+    yield f"  Status: {invoice.status}"
+    yield f"  Invoice Date: {invoice.invoice_date.strftime('%Y-%m-%d')}"
+    yield f"  Due Date: {invoice.due_date.strftime('%Y-%m-%d')}"
+    yield f"  Payment Terms: {invoice.payment_terms}"
     
     if invoice.payment_date:
-        print(f"  Payment Date: {invoice.payment_date.strftime('%Y-%m-%d')}")
+        yield f"  Payment Date: {invoice.payment_date.strftime('%Y-%m-%d')}"
     
-    print(f"\n  Line Items:")
+    yield f"\n  Line Items:"
     for item in invoice.line_items:
-        print(f"    - {item.description}")
-        print(f"      Code: {item.item_code} | Qty: {item.quantity} | Unit Price: ${item.unit_price:.2f}")
-        print(f"      Subtotal: ${item.subtotal:.2f} | Tax: ${item.tax_amount:.2f} | Total: ${item.total:.2f}")
+        yield f"    - {item.description}"
+        yield f"      Code: {item.item_code} | Qty: {item.quantity} | Unit Price: ${item.unit_price:.2f}"
+        yield f"      Subtotal: ${item.subtotal:.2f} | Tax: ${item.tax_amount:.2f} | Total: ${item.total:.2f}"
     
-    print(f"\n  Financial Summary:")
-    print(f"    Subtotal: ${invoice.subtotal:.2f}")
-    print(f"    Tax Total: ${invoice.tax_total:.2f}")
-    print(f"    Total Amount: ${invoice.total_amount:.2f}")
+    yield f"\n  Financial Summary:"
+    yield f"    Subtotal: ${invoice.subtotal:.2f}"
+    yield f"    Tax Total: ${invoice.tax_total:.2f}"
+    yield f"    Total Amount: ${invoice.total_amount:.2f}"
     
     if invoice.approvals:
-        print(f"\n  Approval History:")
+        yield f"\n  Approval History:"
         for approval in invoice.approvals:
-            print(f"    - {approval.approver}: {approval.status}")
+            yield f"    - {approval.approver}: {approval.status}"
             if approval.comments:
-                print(f"      Comment: {approval.comments}")
-            print(f"      Timestamp: {approval.timestamp.strftime('%Y-%m-%d %H:%M')}")
+                yield f"      Comment: {approval.comments}"
+            yield f"      Timestamp: {approval.timestamp.strftime('%Y-%m-%d %H:%M')}"
     
     if invoice.notes:
-        print(f"\n  Notes: {invoice.notes}")
+        yield f"\n  Notes: {invoice.notes}"
+
+
+def print_invoice_details(invoice):
+    """Print invoice details"""
+    sys.stdout.write("\n".join(_invoice_lines(invoice)) + "\n")
+
+
+def _write_documents(documents: Iterable, lines_fn: Callable[..., Iterator[str]]):
+    """Write every document's detail lines, each followed by a separator, in a single write"""
+    separator = ("-" * 80,)
+    sys.stdout.write("\n".join(chain.from_iterable(
+        chain(lines_fn(doc), separator) for doc in documents
+    )) + "\n")
 
 
 def display_all_purchase_orders(workflow: P2PWorkflow):
@@ -117,9 +144,7 @@ def display_all_purchase_orders(workflow: P2PWorkflow):
         print("\nNo purchase orders found.")
         return
     
-    for po in workflow.purchase_orders.values():
-        print_po_details(po)
-        print("-" * 80)
+    _write_documents(workflow.purchase_orders.values(), _po_lines)
 
 
 def display_all_goods_receipts(workflow: P2PWorkflow):
@@ -130,9 +155,7 @@ def display_all_goods_receipts(workflow: P2PWorkflow):
         print("\nNo goods receipts found.")
         return
     
-    for gr in workflow.goods_receipts.values():
-        print_gr_details(gr)
-        print("-" * 80)
+    _write_documents(workflow.goods_receipts.values(), _gr_lines)
 
 
 def display_all_invoices(workflow: P2PWorkflow):
@@ -143,9 +166,7 @@ def display_all_invoices(workflow: P2PWorkflow):
         print("\nNo invoices found.")
         return
     
-    for invoice in workflow.invoices.values():
-        print_invoice_details(invoice)
-        print("-" * 80)
+    _write_documents(workflow.invoices.values(), _invoice_lines)
 
 
 def display_approval_policies(workflow: P2PWorkflow):
@@ -314,6 +335,14 @@ def display_menu():
     print("\n" + "=" * 80)
 
 
+def _po_number_lookup(workflow: P2PWorkflow) -> Dict[str, str]:
+    """Map PO numbers to PO IDs (first PO wins on duplicate numbers)"""
+    index = {}
+    for po_id, po in workflow.purchase_orders.items():
+        index.setdefault(po.po_number, po_id)
+    return index
+
+
 def main():
     """Main application entry point"""
     print_header("PURCHASE-TO-PAY (P2P) WORKFLOW PROTOTYPE")
@@ -323,6 +352,7 @@ def main():
     
     print("\nGenerating sample data...")
     workflow = generate_sample_data()
+    po_number_index = _po_number_lookup(workflow)
     
     while True:
         display_menu()
@@ -346,11 +376,7 @@ def main():
                 print(f"  - {po.po_number} (ID: {po_id})")
             po_input = input("\nEnter PO ID or PO Number: ").strip()
             # Find PO by ID or number
-            found_po = None
-            for po_id, po in workflow.purchase_orders.items():
-                if po_id == po_input or po.po_number == po_input:
-                    found_po = po_id
-                    break
+            found_po = po_input if po_input in workflow.purchase_orders else po_number_index.get(po_input)
             if found_po:
                 display_po_summary(workflow, found_po)
             else:
@@ -360,6 +386,7 @@ def main():
         elif choice == '9':
             print("\nRegenerating sample data...")
             workflow = generate_sample_data()
+            po_number_index = _po_number_lookup(workflow)
         elif choice == '10':
             print_header("THANK YOU")
             print("\nThank you for using the P2P Workflow Prototype!")
@@ -4,11 +4,21 @@ Data models for Purchase-to-Pay business process
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import List, Optional
-import uuid
+from typing import Dict, List, Optional, Tuple
+from os import urandom
 
 
-class POStatus(Enum):
+class _ValueEnum(Enum):
+    """Enum that prints as its value"""
+    
+    def __str__(self) -> str:
+        return self._value_
+    
+    def __format__(self, format_spec: str) -> str:
+        return format(self._value_, format_spec)
+
+
+class POStatus(_ValueEnum):
     """Purchase Order status"""
     DRAFT = "Draft"
     PENDING_APPROVAL = "Pending Approval"
@@ -20,7 +30,7 @@ class POStatus(Enum):
     BLOCKED = "Blocked"
 
 
-class GRStatus(Enum):
+class GRStatus(_ValueEnum):
     """Goods Receipt status"""
     DRAFT = "Draft"
     RECEIVED = "Received"
@@ -30,7 +40,7 @@ class GRStatus(Enum):
     BLOCKED = "Blocked"
 
 
-class InvoiceStatus(Enum):
+class InvoiceStatus(_ValueEnum):
     """Invoice status"""
     DRAFT = "Draft"
     PENDING_APPROVAL = "Pending Approval"
@@ -41,7 +51,27 @@ class InvoiceStatus(Enum):
     BLOCKED = "Blocked"
 
 
-class PaymentTerms(Enum):
+class BlockedCategory(Enum):
+    """Kind of issue behind a blocked_reason"""
+    PRICE = "Price"
+    THREE_WAY = "Three-Way"
+    MATCHING = "Matching"
+    OTHER = "Other"
+    
+    @classmethod
+    def from_reason(cls, reason: str) -> "BlockedCategory":
+        """Classify a free-text blocked reason (price takes precedence over three-way, then matching)"""
+        reason = reason.lower()
+        if "pricing" in reason or "price" in reason:
+            return cls.PRICE
+        if "three-way" in reason:
+            return cls.THREE_WAY
+        if "matching" in reason:
+            return cls.MATCHING
+        return cls.OTHER
+
+
+class PaymentTerms(_ValueEnum):
     """Payment terms"""
     NET_30 = "Net 30 Days"
     NET_60 = "Net 60 Days"
@@ -50,10 +80,22 @@ class PaymentTerms(Enum):
     DUE_ON_RECEIPT = "Due on Receipt"
 
 
-@dataclass
+# Days until an invoice falls due under each payment term
+_PAYMENT_DAYS = {
+    PaymentTerms.IMMEDIATE: 0,
+    PaymentTerms.DUE_ON_RECEIPT: 0,
+    PaymentTerms.NET_30: 30,
+    PaymentTerms.NET_60: 60,
+    PaymentTerms.NET_90: 90
+}
+_PAYMENT_DELTAS = {terms: timedelta(days=days) for terms, days in _PAYMENT_DAYS.items()}
+_DEFAULT_PAYMENT_DELTA = timedelta(days=30)
+
+
+@dataclass(slots=True)
 class ApprovalPolicy:
     """Approval policy configuration"""
-    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = field(default_factory=lambda: urandom(16).hex())
     name: str = ""
     description: str = ""
     min_amount: float = 0.0
@@ -66,43 +108,96 @@ class ApprovalPolicy:
         return self.min_amount <= amount <= self.max_amount
 
 
-@dataclass
+@dataclass(slots=True)
 class ApprovalRecord:
     """Individual approval record"""
-    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = field(default_factory=lambda: urandom(16).hex())
     approver: str = ""
     status: str = "Pending"  # Pending, Approved, Rejected
     comments: str = ""
     timestamp: datetime = field(default_factory=datetime.now)
 
 
-@dataclass
+@dataclass(slots=True)
 class LineItem:
     """Line item for PO/Invoice"""
-    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = field(default_factory=lambda: urandom(16).hex())
     item_code: str = ""
     description: str = ""
     quantity: float = 0.0
     unit_price: float = 0.0
     tax_rate: float = 0.0
+    # Derived amounts, fixed at construction
+    subtotal: float = field(default=0.0, init=False, repr=False, compare=False)
+    tax_amount: float = field(default=0.0, init=False, repr=False, compare=False)
+    total: float = field(default=0.0, init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        self.subtotal = self.quantity * self.unit_price
+        self.tax_amount = self.subtotal * self.tax_rate
+        self.total = self.subtotal + self.tax_amount
+
+
+@dataclass(slots=True)
+class _LineItemTotals:
+    """Base for documents with line_items: single-pass, cached subtotal/tax/total"""
+    # Cached (subtotal, tax_total, total_amount) over line_items (see _compute_totals)
+    _totals_cache: Optional[Tuple[float, float, float]] = field(default=None, init=False, repr=False, compare=False)
+    _totals_items: Optional[List[LineItem]] = field(default=None, init=False, repr=False, compare=False)
+    _totals_len: int = field(default=0, init=False, repr=False, compare=False)
+    
+    def _compute_totals(self) -> Tuple[float, float, float]:
+        """(subtotal, tax_total, total_amount) in one pass, recomputed only when line_items is replaced or resized"""
+        items = self.line_items
+        if self._totals_cache is None or items is not self._totals_items or len(items) != self._totals_len:
+            s = t = total = 0.0
+            for it in items:
+                s += it.subtotal
+                t += it.tax_amount
+                total += it.total
+            self._totals_cache = (s, t, total)
+            self._totals_items = items
+            self._totals_len = len(items)
+        return self._totals_cache
     
     @property
     def subtotal(self) -> float:
-        return self.quantity * self.unit_price
+        return self._compute_totals()[0]
     
     @property
-    def tax_amount(self) -> float:
-        return self.subtotal * self.tax_rate
+    def tax_total(self) -> float:
+        return self._compute_totals()[1]
     
     @property
-    def total(self) -> float:
-        return self.subtotal + self.tax_amount
+    def total_amount(self) -> float:
+        return self._compute_totals()[2]
 
 
-@dataclass
-class PurchaseOrder:
+@dataclass(slots=True)
+class _ApprovableDocument(_LineItemTotals):
+    """Base for documents with approvals: per-approver index and count of records not yet approved"""
+    # Approval records by approver and count of records not yet approved (see _index_approval)
+    _approvals_by_approver: Dict[str, List[ApprovalRecord]] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _unapproved_count: int = field(default=0, init=False, repr=False, compare=False)
+    
+    def _index_approval(self, approval: ApprovalRecord):
+        """Register an approval record in the per-approver index"""
+        self._approvals_by_approver.setdefault(approval.approver, []).append(approval)
+        if approval.status != "Approved":
+            self._unapproved_count += 1
+    
+    def _pending_approval(self, approver: str) -> Optional[ApprovalRecord]:
+        """First pending approval record for approver, if any"""
+        for approval in self._approvals_by_approver.get(approver, ()):
+            if approval.status == "Pending":
+                return approval
+        return None
+
+
+@dataclass(slots=True)
+class PurchaseOrder(_ApprovableDocument):
     """Purchase Order"""
-    id: str = field(default_factory=lambda: f"PO-{uuid.uuid4().hex[:8].upper()}")
+    id: str = field(default_factory=lambda: f"PO-{urandom(4).hex().upper()}")
     po_number: str = ""
     vendor_id: str = ""
     vendor_name: str = ""
@@ -118,63 +213,69 @@ class PurchaseOrder:
     approvals: List[ApprovalRecord] = field(default_factory=list)
     applicable_policy: Optional[ApprovalPolicy] = None
     blocked_reason: str = ""
+    # Cached "YYYY-MM" of creation_date (see month_key)
+    _month_key: str = field(default="", init=False, repr=False, compare=False)
+    _month_key_date: Optional[datetime] = field(default=None, init=False, repr=False, compare=False)
     
     def __post_init__(self):
         if not self.po_number:
             self.po_number = self.id
+        for approval in self.approvals:
+            self._index_approval(approval)
     
     @property
-    def subtotal(self) -> float:
-        return sum(item.subtotal for item in self.line_items)
-    
-    @property
-    def tax_total(self) -> float:
-        return sum(item.tax_amount for item in self.line_items)
-    
-    @property
-    def total_amount(self) -> float:
-        return sum(item.total for item in self.line_items)
+    def month_key(self) -> str:
+        """Creation month as 'YYYY-MM', recomputed only when creation_date changes"""
+        d = self.creation_date
+        if d is not self._month_key_date:
+            self._month_key = f"{d.year:04d}-{d.month:02d}"
+            self._month_key_date = d
+        return self._month_key
     
     def add_line_item(self, item: LineItem):
         """Add a line item to the PO"""
         self.line_items.append(item)
+        self._totals_cache = None
     
     def submit_for_approval(self, policy: ApprovalPolicy):
         """Submit PO for approval"""
         self.status = POStatus.PENDING_APPROVAL
         self.applicable_policy = policy
+        # One submission timestamp shared by the whole batch of records
+        now = datetime.now()
         for approver in policy.required_approvers:
-            self.approvals.append(ApprovalRecord(approver=approver))
+            approval = ApprovalRecord(approver=approver, timestamp=now)
+            self.approvals.append(approval)
+            self._index_approval(approval)
     
     def approve(self, approver: str, comments: str = ""):
         """Approve the PO"""
-        for approval in self.approvals:
-            if approval.approver == approver and approval.status == "Pending":
-                approval.status = "Approved"
-                approval.comments = comments
-                approval.timestamp = datetime.now()
-                break
+        approval = self._pending_approval(approver)
+        if approval:
+            approval.status = "Approved"
+            approval.comments = comments
+            approval.timestamp = datetime.now()
+            self._unapproved_count -= 1
         
         # Check if all approvals are completed
-        if all(a.status == "Approved" for a in self.approvals):
+        if self._unapproved_count == 0:
             self.status = POStatus.APPROVED
             self.approval_date = datetime.now()
     
     def reject(self, approver: str, comments: str = ""):
         """Reject the PO"""
-        for approval in self.approvals:
-            if approval.approver == approver and approval.status == "Pending":
-                approval.status = "Rejected"
-                approval.comments = comments
-                approval.timestamp = datetime.now()
-                break
+        approval = self._pending_approval(approver)
+        if approval:
+            approval.status = "Rejected"
+            approval.comments = comments
+            approval.timestamp = datetime.now()
         self.status = POStatus.REJECTED
 
 
-@dataclass
-class GoodsReceipt:
+@dataclass(slots=True)
+class GoodsReceipt(_LineItemTotals):
     """Goods Receipt"""
-    id: str = field(default_factory=lambda: f"GR-{uuid.uuid4().hex[:8].upper()}")
+    id: str = field(default_factory=lambda: f"GR-{urandom(4).hex().upper()}")
     gr_number: str = ""
     po_id: str = ""
     po_number: str = ""
@@ -192,10 +293,6 @@ class GoodsReceipt:
         if not self.gr_number:
             self.gr_number = self.id
     
-    @property
-    def total_amount(self) -> float:
-        return sum(item.total for item in self.line_items)
-    
     def receive_goods(self):
         """Mark goods as received"""
         self.status = GRStatus.RECEIVED
@@ -213,10 +310,10 @@ class GoodsReceipt:
             self.status = GRStatus.REJECTED
 
 
-@dataclass
-class Invoice:
+@dataclass(slots=True)
+class Invoice(_ApprovableDocument):
     """Invoice"""
-    id: str = field(default_factory=lambda: f"INV-{uuid.uuid4().hex[:8].upper()}")
+    id: str = field(default_factory=lambda: f"INV-{urandom(4).hex().upper()}")
     invoice_number: str = ""
     po_id: str = ""
     po_number: str = ""
@@ -234,55 +331,53 @@ class Invoice:
     approvals: List[ApprovalRecord] = field(default_factory=list)
     applicable_policy: Optional[ApprovalPolicy] = None
     blocked_reason: str = ""
+    # Cached category of blocked_reason (see blocked_category)
+    _blocked_category: Optional[BlockedCategory] = field(default=None, init=False, repr=False, compare=False)
+    _blocked_category_reason: Optional[str] = field(default=None, init=False, repr=False, compare=False)
     
     def __post_init__(self):
         if not self.invoice_number:
             self.invoice_number = self.id
         if not self.due_date:
             self.calculate_due_date()
+        for approval in self.approvals:
+            self._index_approval(approval)
     
     @property
-    def subtotal(self) -> float:
-        return sum(item.subtotal for item in self.line_items)
-    
-    @property
-    def tax_total(self) -> float:
-        return sum(item.tax_amount for item in self.line_items)
-    
-    @property
-    def total_amount(self) -> float:
-        return sum(item.total for item in self.line_items)
+    def blocked_category(self) -> BlockedCategory:
+        """Category of blocked_reason, reclassified only when blocked_reason changes"""
+        reason = self.blocked_reason
+        if reason is not self._blocked_category_reason:
+            self._blocked_category = BlockedCategory.from_reason(reason)
+            self._blocked_category_reason = reason
+        return self._blocked_category
     
     def calculate_due_date(self):
         """Calculate due date based on payment terms"""
-        days_map = {
-            PaymentTerms.IMMEDIATE: 0,
-            PaymentTerms.DUE_ON_RECEIPT: 0,
-            PaymentTerms.NET_30: 30,
-            PaymentTerms.NET_60: 60,
-            PaymentTerms.NET_90: 90
-        }
-        days = days_map.get(self.payment_terms, 30)
-        self.due_date = self.invoice_date + timedelta(days=days)
+        self.due_date = self.invoice_date + _PAYMENT_DELTAS.get(self.payment_terms, _DEFAULT_PAYMENT_DELTA)
     
     def submit_for_approval(self, policy: ApprovalPolicy):
         """Submit invoice for approval"""
         self.status = InvoiceStatus.PENDING_APPROVAL
         self.applicable_policy = policy
+        # One submission timestamp shared by the whole batch of records
+        now = datetime.now()
         for approver in policy.required_approvers:
-            self.approvals.append(ApprovalRecord(approver=approver))
+            approval = ApprovalRecord(approver=approver, timestamp=now)
+            self.approvals.append(approval)
+            self._index_approval(approval)
     
     def approve(self, approver: str, comments: str = ""):
         """Approve the invoice"""
-        for approval in self.approvals:
-            if approval.approver == approver and approval.status == "Pending":
-                approval.status = "Approved"
-                approval.comments = comments
-                approval.timestamp = datetime.now()
-                break
+        approval = self._pending_approval(approver)
+        if approval:
+            approval.status = "Approved"
+            approval.comments = comments
+            approval.timestamp = datetime.now()
+            self._unapproved_count -= 1
         
         # Check if all approvals are completed
-        if all(a.status == "Approved" for a in self.approvals):
+        if self._unapproved_count == 0:
             self.status = InvoiceStatus.APPROVED
     
     def mark_as_paid(self):
@@ -0,0 +1,43 @@
+"""
+Numeric kernels for the document statistics / outlier tools and KG vendor risk scoring
+Vectorized NumPy over float64/int64 arrays
+"""
+import numpy as np
+
+
+def compute_stats(amounts):
+    """
+    Summary statistics over document amounts from a single sorted copy
+    Returns (count, total, mean, median, std, min, max, p25, p50, p75, p95)
+    """
+    a = np.sort(amounts)
+    n = a.shape[0]
+    total = np.sum(a)
+    mean = total / n
+    std = np.sqrt(np.sum((a - mean) ** 2) / n)
+    mid = n // 2
+    median = a[mid] if n % 2 else (a[mid - 1] + a[mid]) / 2
+    p25, p50, p75, p95 = np.percentile(a, np.array([25.0, 50.0, 75.0, 95.0]))
+    return (float(n), total, mean, median, std, a[0], a[n - 1], p25, p50, p75, p95)
+
+
+def z_scores(amounts, mean, std):
+    """Absolute z-score of each amount (all zeros when std is 0)"""
+    if std > 0:
+        return np.abs(amounts - mean) / std
+    return np.zeros_like(amounts)
+
+
+def zscore_outliers(amounts, mean, std, threshold):
+    """Indices and absolute z-scores of amounts above threshold"""
+    z = z_scores(amounts, mean, std)
+    idx = np.flatnonzero(z > threshold)
+    return idx, z[idx]
+
+
+def score_vendors(blocked, rejected, overdue, txn_count):
+    """Risk score (floored at 0) and level code 0/1/2 = LOW/MEDIUM/HIGH per vendor"""
+    s = blocked * 20 + rejected * 30 + overdue * 15
+    s[(txn_count > 5) & (s == 0)] = -10
+    levels = (s >= 30).astype(np.int8) + (s >= 60)
+    return np.maximum(s, 0), levels
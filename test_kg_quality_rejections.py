@@ -0,0 +1,66 @@
+"""
+Test quality-rejection reasoning in the Knowledge Graph
+A rejected goods receipt (linked GR -> PO by a VALIDATES edge) must count
+against its vendor in risk scores and vendor recommendations
+"""
+from workflow import P2PWorkflow
+from models import LineItem
+from kg_reasoning import P2PKnowledgeGraph
+
+
+def create_received_po(workflow: P2PWorkflow, vendor_id: str, vendor_name: str, passed: bool):
+    """Create an approved laptop PO for a vendor and receive it with the given quality result"""
+    po = workflow.create_purchase_order(
+        vendor_id=vendor_id,
+        vendor_name=vendor_name,
+        requester="Test Requester",
+        department="IT",
+        line_items=[LineItem(item_code="LAP-01", description="Laptop computer",
+                             quantity=2, unit_price=500.0, tax_rate=0.1)]
+    )
+    # No approval policies configured, so submitting auto-approves
+    workflow.submit_po_for_approval(po.id)
+    gr = workflow.create_goods_receipt(
+        po.id, "Warehouse",
+        [LineItem(item_code="LAP-01", description="Laptop computer",
+                  quantity=2, unit_price=500.0, tax_rate=0.1)]
+    )
+    workflow.perform_quality_check(gr.id, "QA Inspector", passed=passed)
+    return po, gr
+
+
+def main():
+    """Build a two-vendor workflow and check the quality-related results"""
+    workflow = P2PWorkflow()
+    create_received_po(workflow, "V-REJ", "Rejecting Vendor", passed=False)
+    create_received_po(workflow, "V-OK", "Reliable Vendor", passed=True)
+    
+    kg = P2PKnowledgeGraph()
+    kg.build_graph_from_workflow(workflow)
+    
+    # Risk scores: one rejected receipt is +30, which is MEDIUM risk
+    risks = kg.calculate_vendor_risk_scores()
+    print(f"Risk scores: {risks}")
+    
+    assert risks["V-REJ"]["risk_score"] == 30
+    assert risks["V-REJ"]["risk_level"] == "MEDIUM"
+    assert risks["V-REJ"]["factors"] == ["Quality rejections: +30"]
+    assert risks["V-OK"]["risk_score"] == 0
+    assert risks["V-OK"]["risk_level"] == "LOW"
+    assert risks["V-OK"]["factors"] == []
+    
+    # Recommendations: the rejection shows up as a quality issue and ranks the vendor last
+    recommendations = kg.recommend_vendors("IT Equipment")
+    print(f"Recommendations: {recommendations}")
+    
+    by_vendor = {rec["vendor_id"]: rec for rec in recommendations}
+    assert [rec["vendor_id"] for rec in recommendations] == ["V-OK", "V-REJ"]
+    assert by_vendor["V-REJ"]["quality_issues"] == 1
+    assert by_vendor["V-REJ"]["blocked_count"] == 0
+    assert by_vendor["V-OK"]["quality_issues"] == 0
+    
+    print("\n✓ Quality rejections are reflected in risk scores and recommendations")
+
+
+if __name__ == "__main__":
+    main()
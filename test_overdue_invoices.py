@@ -0,0 +1,83 @@
+"""
+Test overdue invoice detection
+Invoices approved through the workflow and invoices approved directly on the
+model must both be flagged overdue, and repeated approvals must not queue
+duplicate due-date entries
+"""
+from datetime import datetime, timedelta
+from workflow import P2PWorkflow
+from models import ApprovalPolicy, InvoiceStatus, LineItem, PaymentTerms
+
+
+def create_invoice(workflow: P2PWorkflow, vendor_id: str):
+    """Create an invoice for a received PO, dated 10 days ago with immediate payment terms"""
+    po = workflow.create_purchase_order(
+        vendor_id=vendor_id,
+        vendor_name=f"Vendor {vendor_id}",
+        requester="Test Requester",
+        department="Finance",
+        line_items=[LineItem(item_code="PAP-01", description="Copy paper",
+                             quantity=10, unit_price=5.0, tax_rate=0.1)]
+    )
+    workflow.submit_po_for_approval(po.id)
+    workflow.approve_po(po.id, "Manager")
+    gr = workflow.create_goods_receipt(
+        po.id, "Warehouse",
+        [LineItem(item_code="PAP-01", description="Copy paper", quantity=10, unit_price=5.0, tax_rate=0.1)]
+    )
+    workflow.perform_quality_check(gr.id, "QA Inspector", passed=True)
+    invoice = workflow.create_invoice(
+        po.id, gr.id, vendor_id, f"Vendor {vendor_id}",
+        [LineItem(item_code="PAP-01", description="Copy paper", quantity=10, unit_price=5.0, tax_rate=0.1)],
+        payment_terms=PaymentTerms.IMMEDIATE
+    )
+    invoice.invoice_date = datetime.now() - timedelta(days=10)
+    invoice.calculate_due_date()
+    workflow.submit_invoice_for_approval(invoice.id)
+    return invoice
+
+
+def main():
+    """Approve invoices in different ways and check that all of them turn overdue"""
+    workflow = P2PWorkflow()
+    workflow.add_approval_policy(ApprovalPolicy(
+        name="All documents",
+        min_amount=0,
+        required_approvers=["Manager"]
+    ))
+    
+    # Approved through the workflow, with a repeated approval call
+    via_workflow = create_invoice(workflow, "V-WF")
+    assert workflow.approve_invoice(via_workflow.id, "Manager")
+    workflow.approve_invoice(via_workflow.id, "Manager")
+    
+    # Approved directly on the model, bypassing the workflow
+    direct = create_invoice(workflow, "V-DIRECT")
+    direct.approve("Manager")
+    assert direct.status == InvoiceStatus.APPROVED
+    
+    # Pending invoices are never flagged
+    pending = create_invoice(workflow, "V-PENDING")
+    
+    workflow.check_overdue_invoices()
+    print(f"Statuses: {[(inv.vendor_id, inv.status.value) for inv in workflow.invoices.values()]}")
+    
+    assert via_workflow.status == InvoiceStatus.OVERDUE
+    assert direct.status == InvoiceStatus.OVERDUE
+    assert pending.status == InvoiceStatus.PENDING_APPROVAL
+    
+    # Flagged invoices leave the queue; nothing was queued twice
+    queued_ids = [invoice_id for _, invoice_id in workflow._overdue_heap]
+    assert len(queued_ids) == len(set(queued_ids))
+    assert via_workflow.id not in queued_ids and direct.id not in queued_ids
+    
+    # A sweep with nothing left to flag does not bump the workflow version
+    version = workflow.version
+    workflow.check_overdue_invoices()
+    assert workflow.version == version
+    
+    print("\n✓ Overdue detection covers workflow and direct approvals without duplicate entries")
+
+
+if __name__ == "__main__":
+    main()
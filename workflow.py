@@ -1,7 +1,10 @@
 """
 Business logic and workflow for Purchase-to-Pay process
 """
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
+from collections import defaultdict
+from datetime import datetime
+import heapq
 from models import (
     PurchaseOrder, GoodsReceipt, Invoice, LineItem,
     ApprovalPolicy, POStatus, GRStatus, InvoiceStatus, PaymentTerms
@@ -17,12 +20,25 @@ class P2PWorkflow:
         self.goods_receipts: Dict[str, GoodsReceipt] = {}
         self.invoices: Dict[str, Invoice] = {}
         self.approval_policies: List[ApprovalPolicy] = []
+        # Bumped on every change so callers can cache derived data
+        self.version = 0
+        # Documents grouped by status (see _documents_by_status)
+        self._status_index: Dict = {}
+        self._status_index_version = -1
+        # get_statistics result for _statistics_version
+        self._statistics: Dict = {}
+        self._statistics_version = -1
+        # (due_date, invoice_id) for invoices that were approved, earliest due first,
+        # and the ids that currently have an entry (at most one per invoice)
+        self._overdue_heap: List[Tuple[datetime, str]] = []
+        self._overdue_tracked: set = set()
     
     def add_approval_policy(self, policy: ApprovalPolicy):
         """Add an approval policy"""
         self.approval_policies.append(policy)
         # Sort policies by min_amount to ensure correct matching
         self.approval_policies.sort(key=lambda p: p.min_amount)
+        self.version += 1
     
     def get_applicable_policy(self, amount: float) -> Optional[ApprovalPolicy]:
         """Get the applicable approval policy for a given amount"""
@@ -57,6 +73,7 @@ class P2PWorkflow:
             po.add_line_item(item)
         
         self.purchase_orders[po.id] = po
+        self.version += 1
         return po
     
     def submit_po_for_approval(self, po_id: str) -> bool:
@@ -72,9 +89,11 @@ class P2PWorkflow:
         if not policy:
             # No policy applicable, auto-approve
             po.status = POStatus.APPROVED
+            self.version += 1
             return True
         
         po.submit_for_approval(policy)
+        self.version += 1
         return True
     
     def approve_po(self, po_id: str, approver: str, comments: str = "") -> bool:
@@ -89,6 +108,7 @@ class P2PWorkflow:
         if po.status == POStatus.APPROVED:
             po.status = POStatus.APPROVED
         
+        self.version += 1
         return True
     
     def reject_po(self, po_id: str, approver: str, comments: str = "") -> bool:
@@ -98,6 +118,7 @@ class P2PWorkflow:
             return False
         
         po.reject(approver, comments)
+        self.version += 1
         return True
     
     def create_goods_receipt(
@@ -127,6 +148,7 @@ class P2PWorkflow:
         
         # Update PO status
         po.status = POStatus.IN_PROGRESS
+        self.version += 1
         
         return gr
     
@@ -152,6 +174,7 @@ class P2PWorkflow:
                 if all(g.status == GRStatus.ACCEPTED for g in po_grs):
                     po.status = POStatus.COMPLETED
         
+        self.version += 1
         return True
     
     def create_invoice(
@@ -193,6 +216,7 @@ class P2PWorkflow:
             invoice.line_items.append(item)
         
         self.invoices[invoice.id] = invoice
+        self.version += 1
         return invoice
     
     def submit_invoice_for_approval(self, invoice_id: str) -> bool:
@@ -205,9 +229,12 @@ class P2PWorkflow:
         if not policy:
             # No policy applicable, auto-approve
             invoice.status = InvoiceStatus.APPROVED
+            self._track_due_date(invoice)
+            self.version += 1
             return True
         
         invoice.submit_for_approval(policy)
+        self.version += 1
         return True
     
     def approve_invoice(self, invoice_id: str, approver: str, comments: str = "") -> bool:
@@ -217,6 +244,10 @@ class P2PWorkflow:
             return False
         
         invoice.approve(approver, comments)
+        # Queue it only on the transition from pending into approved
+        if invoice.status == InvoiceStatus.APPROVED:
+            self._track_due_date(invoice)
+        self.version += 1
         return True
     
     def pay_invoice(self, invoice_id: str) -> bool:
@@ -226,12 +257,44 @@ class P2PWorkflow:
             return False
         
         invoice.mark_as_paid()
+        self.version += 1
         return True
     
-    def check_overdue_invoices(self):
-        """Check and update status of overdue invoices"""
+    def _track_due_date(self, invoice: Invoice):
+        """Queue an approved invoice for the overdue check, unless it already has an entry"""
+        if (invoice.status == InvoiceStatus.APPROVED and invoice.due_date
+                and invoice.id not in self._overdue_tracked):
+            heapq.heappush(self._overdue_heap, (invoice.due_date, invoice.id))
+            self._overdue_tracked.add(invoice.id)
+    
+    def check_overdue_invoices(self, batch: Optional[int] = None):
+        """Check and update status of overdue invoices (at most batch past-due entries per call)"""
+        # Pick up invoices approved outside the workflow (e.g. Invoice.approve called directly)
         for invoice in self.invoices.values():
+            if invoice.status == InvoiceStatus.APPROVED and invoice.id not in self._overdue_tracked:
+                self._track_due_date(invoice)
+        
+        heap = self._overdue_heap
+        now = datetime.now()
+        checked = 0
+        changed = False
+        while heap and heap[0][0] < now and (batch is None or checked < batch):
+            due_date, invoice_id = heapq.heappop(heap)
+            self._overdue_tracked.discard(invoice_id)
+            invoice = self.invoices.get(invoice_id)
+            # Entries go stale when the invoice was paid, blocked or rescheduled since approval
+            if not invoice or invoice.status != InvoiceStatus.APPROVED:
+                continue
+            if invoice.due_date != due_date:
+                self._track_due_date(invoice)
+                continue
             invoice.check_overdue()
+            checked += 1
+            if invoice.status == InvoiceStatus.OVERDUE:
+                changed = True
+        # Only a real status change invalidates version-keyed caches
+        if changed:
+            self.version += 1
     
     def get_po_summary(self, po_id: str) -> Optional[Dict]:
         """Get summary of a purchase order and its related documents"""
@@ -251,12 +314,22 @@ class P2PWorkflow:
             'total_paid': sum(inv.total_amount for inv in related_invoices if inv.status == InvoiceStatus.PAID)
         }
     
+    def _documents_by_status(self) -> Dict:
+        """POs, GRs and invoices grouped by status enum member, rebuilt at most once per version"""
+        if self._status_index_version != self.version:
+            index = defaultdict(list)
+            for docs in (self.purchase_orders, self.goods_receipts, self.invoices):
+                for doc in docs.values():
+                    index[doc.status].append(doc)
+            self._status_index = index
+            self._status_index_version = self.version
+        return self._status_index
+    
     def get_all_pending_approvals(self) -> Dict:
         """Get all documents pending approval"""
-        pending_pos = [po for po in self.purchase_orders.values() 
-                      if po.status == POStatus.PENDING_APPROVAL]
-        pending_invoices = [inv for inv in self.invoices.values() 
-                           if inv.status == InvoiceStatus.PENDING_APPROVAL]
+        by_status = self._documents_by_status()
+        pending_pos = list(by_status.get(POStatus.PENDING_APPROVAL, ()))
+        pending_invoices = list(by_status.get(InvoiceStatus.PENDING_APPROVAL, ()))
         
         return {
             'purchase_orders': pending_pos,
@@ -270,6 +343,7 @@ class P2PWorkflow:
             return False
         po.status = POStatus.BLOCKED
         po.blocked_reason = reason
+        self.version += 1
         return True
     
     def block_gr(self, gr_id: str, reason: str) -> bool:
@@ -279,6 +353,7 @@ class P2PWorkflow:
             return False
         gr.status = GRStatus.BLOCKED
         gr.blocked_reason = reason
+        self.version += 1
         return True
     
     def block_invoice(self, invoice_id: str, reason: str) -> bool:
@@ -287,6 +362,7 @@ class P2PWorkflow:
         if not invoice:
             return False
         invoice.block(reason)
+        self.version += 1
         return True
     
     def unblock_invoice(self, invoice_id: str) -> bool:
@@ -295,16 +371,15 @@ class P2PWorkflow:
         if not invoice:
             return False
         invoice.unblock()
+        self.version += 1
         return True
     
     def get_blocked_documents(self) -> Dict:
         """Get all blocked documents"""
-        blocked_pos = [po for po in self.purchase_orders.values() 
-                      if po.status == POStatus.BLOCKED]
-        blocked_grs = [gr for gr in self.goods_receipts.values() 
-                      if gr.status == GRStatus.BLOCKED]
-        blocked_invoices = [inv for inv in self.invoices.values() 
-                           if inv.status == InvoiceStatus.BLOCKED]
+        by_status = self._documents_by_status()
+        blocked_pos = list(by_status.get(POStatus.BLOCKED, ()))
+        blocked_grs = list(by_status.get(GRStatus.BLOCKED, ()))
+        blocked_invoices = list(by_status.get(InvoiceStatus.BLOCKED, ()))
         
         return {
             'purchase_orders': blocked_pos,
@@ -313,27 +388,27 @@ class P2PWorkflow:
         }
     
     def get_statistics(self) -> Dict:
-        """Get overall workflow statistics"""
-        return {
+        """Get overall workflow statistics (computed at most once per version)"""
+        if self._statistics_version == self.version:
+            return dict(self._statistics)
+        by_status = self._documents_by_status()
+        
+        def count(status) -> int:
+            return len(by_status.get(status, ()))
+        
+        self._statistics = {
             'total_pos': len(self.purchase_orders),
-            'approved_pos': len([po for po in self.purchase_orders.values() 
-                                if po.status == POStatus.APPROVED]),
-            'pending_pos': len([po for po in self.purchase_orders.values() 
-                               if po.status == POStatus.PENDING_APPROVAL]),
-            'blocked_pos': len([po for po in self.purchase_orders.values() 
-                               if po.status == POStatus.BLOCKED]),
+            'approved_pos': count(POStatus.APPROVED),
+            'pending_pos': count(POStatus.PENDING_APPROVAL),
+            'blocked_pos': count(POStatus.BLOCKED),
             'total_grs': len(self.goods_receipts),
-            'accepted_grs': len([gr for gr in self.goods_receipts.values() 
-                                if gr.status == GRStatus.ACCEPTED]),
-            'blocked_grs': len([gr for gr in self.goods_receipts.values() 
-                               if gr.status == GRStatus.BLOCKED]),
+            'accepted_grs': count(GRStatus.ACCEPTED),
+            'blocked_grs': count(GRStatus.BLOCKED),
             'total_invoices': len(self.invoices),
-            'paid_invoices': len([inv for inv in self.invoices.values() 
-                                 if inv.status == InvoiceStatus.PAID]),
-            'overdue_invoices': len([inv for inv in self.invoices.values() 
-                                    if inv.status == InvoiceStatus.OVERDUE]),
-            'blocked_invoices': len([inv for inv in self.invoices.values() 
-                                    if inv.status == InvoiceStatus.BLOCKED]),
-            'total_spend': sum(inv.total_amount for inv in self.invoices.values() 
-                              if inv.status == InvoiceStatus.PAID)
+            'paid_invoices': count(InvoiceStatus.PAID),
+            'overdue_invoices': count(InvoiceStatus.OVERDUE),
+            'blocked_invoices': count(InvoiceStatus.BLOCKED),
+            'total_spend': sum(inv.total_amount for inv in by_status.get(InvoiceStatus.PAID, ()))
         }
+        self._statistics_version = self.version
+        return dict(self._statistics)